@@ -1,11 +1,53 @@
 import importlib
 import pkgutil
 
+# the strategies that come with the library, imported without scanning the package
+BUILTIN_STRATEGY_MODULES = (
+    "display_settings_changed",
+    "eeprom_value",
+    "optical_power_and_adc",
+    "optical_power_and_reference_power",
+    "optical_power_and_wavelength",
+    "stored_record_count",
+)
+# installed packages can contribute strategy classes under this entry point group
+STRATEGY_ENTRY_POINT_GROUP = "powermeterlibrary.strategies"
+
+_registered_strategy_classes = [] # see register_strategy()
+_cached_loaders = {} # (package_name, base_class_name, scan_package, load_entry_points) -> loader, see get_strategy_loader()
+
+
+def register_strategy(strategy_class):
+    # class decorator for strategies that live outside of the strategies package, e.g.
+    #   @register_strategy
+    #   class MyStrategy(DataProcessingStrategy): ...
+    # it has to run before the first controller is created or is added to the already loaded strategies
+    if strategy_class not in _registered_strategy_classes:
+        _registered_strategy_classes.append(strategy_class)
+        for loader in _cached_loaders.values():
+            loader.add_strategy(strategy_class())
+    return strategy_class
+
+
+def get_strategy_loader(package_name="DataProcessingStrategies", base_class_name="DataProcessingStrategy", scan_package=True, load_entry_points=False):
+    # the strategies are stateless, so one loader serves every controller of the process and is only built when the first one needs it
+    key = (package_name, base_class_name, scan_package, load_entry_points)
+    loader = _cached_loaders.get(key)
+    if loader is None:
+        loader = _cached_loaders[key] = DataProcessingStrategyLoader(package_name, base_class_name, scan_package, load_entry_points)
+    return loader
+
+
 class DataProcessingStrategyLoader:
-    def __init__(self, package_name, base_class_name):
+    # scan_package: import every module of the package to find the strategies added there, otherwise only the builtin ones.
+    # load_entry_points: also load the strategy classes other packages registered under STRATEGY_ENTRY_POINT_GROUP
+    def __init__(self, package_name, base_class_name, scan_package=True, load_entry_points=False):
         self.strategies = []
+        self.dispatch_table = {} # (function_nr, function_sub_id or None for any) -> strategy, built once so that a frame finds its strategy in O(1)
         self.package_name = package_name
         self.base_class_name = base_class_name
+        self.scan_package = scan_package
+        self.load_entry_points = load_entry_points
         self.load_strategies()
 
     def load_strategies(self):
@@ -14,8 +56,12 @@ class DataProcessingStrategyLoader:
         # Dynamically import the base class to check against it
         base_module = importlib.import_module(f"{self.package_name}.data_processing_strategy")
         base_class = getattr(base_module, self.base_class_name)
-        # Iterate through the modules in the package
-        for _, module_name, _ in pkgutil.iter_modules(package.__path__, package.__name__ + "."):
+        if self.scan_package:
+            module_names = [module_name for _, module_name, _ in pkgutil.iter_modules(package.__path__, package.__name__ + ".")]
+        else:
+            module_names = [f"{package.__name__}.{module_name}" for module_name in BUILTIN_STRATEGY_MODULES]
+        strategy_classes = []
+        for module_name in module_names:
             # Import the module
             module = importlib.import_module(module_name)
             # Iterate through attributes of the module
@@ -24,6 +70,20 @@ class DataProcessingStrategyLoader:
                 # Check if the attribute is a class, it's not the base class,
                 # and it is a subclass of the base class
                 if isinstance(attribute, type) and attribute is not base_class and issubclass(attribute, base_class):
-                    # Instantiate the class and add it to the strategies list
-                    self.strategies.append(attribute())
+                    strategy_classes.append(attribute)
+        if self.load_entry_points:
+            from importlib.metadata import entry_points # reads the metadata of every installed package, so only on request
+            strategy_classes += [entry_point.load() for entry_point in entry_points(group=STRATEGY_ENTRY_POINT_GROUP)]
+        strategy_classes += _registered_strategy_classes
+        for strategy_class in dict.fromkeys(strategy_classes): # a registered class may have been found by the scan as well
+            self.strategies.append(strategy_class())
+        self.build_dispatch_table()
+
+    def add_strategy(self, strategy):
+        self.strategies.append(strategy)
+        self.dispatch_table.setdefault((strategy.function_nr, strategy.function_sub_id), strategy)
 
+    def build_dispatch_table(self):
+        for strategy in self.strategies:
+            # the first strategy found for a key wins, just like the linear search did before
+            self.dispatch_table.setdefault((strategy.function_nr, strategy.function_sub_id), strategy)
@@ -1,7 +1,16 @@
+import struct
+
 from device_controller import DeviceController
 
+# start byte, function number and function sub number, the rest of the frame is not looked at
+FRAME_HEADER_LAYOUT = struct.Struct('<BBB10x')
+
 
 class DataProcessingStrategy:
+    # every strategy describes the whole 13 byte frame it handles with a precompiled little endian struct,
+    # so all of its fields are decoded with a single unpack_from
+    layout = FRAME_HEADER_LAYOUT
+
     def __init__(self, function_nr, function_sub_id):
         self.function_nr = function_nr
         self.function_sub_id = function_sub_id
@@ -10,5 +19,6 @@ class DataProcessingStrategy:
         raise NotImplementedError
 
     def applies_to(self, function_nr, function_sub_id):
-        return self.function_nr == function_nr and self.function_sub_id == function_sub_id
+        # a function_sub_id of None accepts every function sub number of its function number
+        return self.function_nr == function_nr and self.function_sub_id in (None, function_sub_id)
     
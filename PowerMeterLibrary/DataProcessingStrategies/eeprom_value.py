@@ -0,0 +1,18 @@
+import struct
+
+from DataProcessingStrategies.data_processing_strategy import DataProcessingStrategy
+from device_controller import DeviceController
+
+
+# the response to READ_THE_VALUE_OF_CORRESPONDING_ADDRESS_OF_EEPROM. byte 2 holds the device's function return value
+# instead of a sub number, so every function sub number is accepted
+class EepromValue(DataProcessingStrategy):
+    layout = struct.Struct('<2xB2x8s') # function return value, up to 8 bytes read from the eeprom
+
+    def __init__(self):
+        super().__init__(function_nr=0x20, function_sub_id=None)
+
+    def process_data(self, controller :DeviceController, data):
+        controller.eeprom_function_return_value, controller.eeprom_value = self.layout.unpack_from(data)
+        # the responses carry no address, a download matches them to its requests by their order
+        controller._eeprom_answers.append((0x20, controller.eeprom_function_return_value, controller.eeprom_value))
@@ -1,12 +1,15 @@
+import struct
+
 from DataProcessingStrategies.data_processing_strategy import DataProcessingStrategy
 from device_controller import DeviceController
-from helpers import extract_number
 
 
 class OpticalPowerAndReferencePower(DataProcessingStrategy):
+    layout = struct.Struct('<5xff') # power, reference power
+
     def __init__(self):
         super().__init__(function_nr=1, function_sub_id=1)
 
     def process_data(self, controller , data):
-        controller.optical_power = extract_number(data,5,9)
-        controller.reference_power = extract_number(data,9,13)
\ No newline at end of file
+        optical_power, controller.reference_power = self.layout.unpack_from(data)
+        controller.optical_power = optical_power
\ No newline at end of file
@@ -0,0 +1,17 @@
+import struct
+
+from DataProcessingStrategies.data_processing_strategy import DataProcessingStrategy
+from device_controller import DeviceController
+
+
+# the response to RETURNS_THE_NUMBER_OF_STORED_POWER_RECORDS; byte 2 is not specified, so every function sub number is accepted
+class StoredRecordCount(DataProcessingStrategy):
+    layout = struct.Struct('<5xBB6x') # number of records modulo 255, number of records divided by 255
+
+    def __init__(self):
+        super().__init__(function_nr=0x22, function_sub_id=None)
+
+    def process_data(self, controller :DeviceController, data):
+        remainder, multiple = self.layout.unpack_from(data)
+        controller.stored_record_count = remainder + multiple * 255
+        controller._eeprom_answers.append((0x22, None, controller.stored_record_count)) # marks the end of a batch of a download
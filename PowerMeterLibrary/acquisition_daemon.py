@@ -0,0 +1,432 @@
+import argparse
+import asyncio
+import math
+import os
+import re
+import socket
+import struct
+import sys
+import tempfile
+import time
+from multiprocessing import shared_memory
+
+from device_controller import DeviceController
+from sample_stream import Sample
+
+# only one process can open the serial port of a meter. the daemon owns it and hands the samples to any number of local
+# processes: as a stream over a unix socket, and as the latest samples in a shared memory segment that readers poll
+# without a single system call.
+#   python acquisition_daemon.py --port /dev/ttyUSB0
+# samples leave the daemon as the 41 byte records of the sample logs (sample_logger.LOG_RECORD_DTYPE) with unix times
+SAMPLE_RECORD = struct.Struct("<dB8f")
+
+STREAM_MAGIC = b"PMSTREAM"
+STREAM_VERSION = 1
+STREAM_HEADER = struct.Struct("<8sHH4x") # magic, version, record size; sent once, then one record per sample
+
+# shared memory layout: header, sequence and sample count, then a ring of window_size records
+SHARED_MAGIC = b"PMSHARED"
+SHARED_VERSION = 2
+SHARED_HEADER = struct.Struct("<8sHHII4x") # magic, version, record size, window size, pid of the daemon
+SHARED_SEQUENCE = struct.Struct("<QQ") # seqlock sequence (odd while the daemon writes), samples published so far
+SHARED_SEQUENCE_OFFSET = SHARED_HEADER.size
+SHARED_RING_OFFSET = SHARED_SEQUENCE_OFFSET + SHARED_SEQUENCE.size
+
+
+class DaemonNameInUseError(Exception):
+    pass
+
+
+# every meter gets its own socket and shared memory, so several daemons can run side by side
+def default_socket_path(port):
+    return os.path.join(tempfile.gettempdir(), f"powermeter_{_name_of_port(port)}.sock")
+
+
+def default_shared_memory_name(port):
+    return f"powermeter_{_name_of_port(port)}"
+
+
+def _name_of_port(port):
+    return re.sub(r"[^A-Za-z0-9]+", "_", port).strip("_")
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # runs as another user
+        return True
+    return True
+
+
+def _is_socket_served(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+            return True
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+
+
+def pack_sample(sample, clock_offset):
+    # clock_offset turns the time.perf_counter() of the sample into a unix time
+    nan = math.nan
+    return SAMPLE_RECORD.pack(sample.time + clock_offset, sample.function_sub_nr, *(nan if value is None else value for value in sample[2:]))
+
+
+def unpack_sample(record):
+    # a Sample with a unix time; values the meter never sent are None again
+    return Sample(record[0], record[1], *(None if value != value else value for value in record[2:]))
+
+
+def attach_shared_memory(name):
+    # before python 3.13 the resource tracker also registers segments a process only attaches to and unlinks them when
+    # that process exits. unregistering afterwards would not do, processes started by multiprocessing share the tracker
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+def check_shared_memory_is_stale(name):
+    # raises DaemonNameInUseError unless the segment is missing or its daemon is gone
+    try:
+        segment = attach_shared_memory(name)
+    except FileNotFoundError:
+        return
+    try:
+        magic, version, _, _, pid = SHARED_HEADER.unpack_from(segment.buf, 0)
+    finally:
+        segment.close()
+    if magic != SHARED_MAGIC:
+        raise DaemonNameInUseError(f"the shared memory {name} belongs to another program")
+    if version == SHARED_VERSION and _is_process_alive(pid):
+        raise DaemonNameInUseError(f"the shared memory {name} is served by the running daemon {pid}")
+
+
+# the daemon side of the shared memory segment. every batch of samples is written between two increments of the
+# sequence, a reader that saw the same even sequence before and after copying a value got a consistent one.
+# python knows no memory barriers: this relies on the stores reaching the other cores in order, as they do on x86
+class SharedSampleWriter:
+    def __init__(self, name, window_size=10000):
+        if window_size < 1:
+            raise ValueError(f"window_size must be at least 1, not {window_size}")
+        self.name = name
+        self.window_size = window_size
+        self.count = 0 # samples published so far
+        size = SHARED_RING_OFFSET + window_size * SAMPLE_RECORD.size
+        try:
+            self._segment = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            check_shared_memory_is_stale(name)
+            print(f"removing the shared memory {name} a previous daemon left behind")
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self._segment = shared_memory.SharedMemory(name, create=True, size=size)
+        self._buffer = self._segment.buf
+        self._sequence = 0
+        SHARED_SEQUENCE.pack_into(self._buffer, SHARED_SEQUENCE_OFFSET, 0, 0)
+        SHARED_HEADER.pack_into(self._buffer, 0, SHARED_MAGIC, SHARED_VERSION, SAMPLE_RECORD.size, window_size, os.getpid())
+
+    def publish(self, records):
+        # records: packed SAMPLE_RECORDs, the oldest first
+        buffer = self._buffer
+        window_size = self.window_size
+        first = max(0, len(records) - window_size) # a batch larger than the window only leaves its end behind
+        self._sequence += 1
+        struct.pack_into("<Q", buffer, SHARED_SEQUENCE_OFFSET, self._sequence)
+        for index in range(first, len(records)):
+            offset = SHARED_RING_OFFSET + (self.count + index) % window_size * SAMPLE_RECORD.size
+            buffer[offset:offset + SAMPLE_RECORD.size] = records[index]
+        self.count += len(records)
+        self._sequence += 1
+        SHARED_SEQUENCE.pack_into(buffer, SHARED_SEQUENCE_OFFSET, self._sequence, self.count)
+
+    def close(self):
+        self._buffer = None
+        self._segment.close()
+        self._segment.unlink()
+
+
+# reads the samples the daemon publishes in shared memory. every read unpacks straight from the mapped segment:
+# no system call and no copy besides the unpacked values, so dozens of processes can poll it at a high rate
+class SharedSampleReader:
+    def __init__(self, name):
+        self._segment = attach_shared_memory(name)
+        self._buffer = self._segment.buf
+        magic, version, record_size, self.window_size, self.daemon_pid = SHARED_HEADER.unpack_from(self._buffer, 0)
+        if magic != SHARED_MAGIC:
+            raise ValueError(f"the shared memory {name} was not written by the acquisition daemon")
+        if version != SHARED_VERSION or record_size != SAMPLE_RECORD.size:
+            raise ValueError(f"the shared memory {name} has the unsupported version {version} with {record_size} byte records")
+        self.retries = 0 # reads that overlapped a write of the daemon and were repeated
+        self.write_timeout = 1.0 # seconds a write of the daemon may take before it is considered dead
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    @property
+    def count(self):
+        # samples published so far, poll it to see whether there is a new one
+        return SHARED_SEQUENCE.unpack_from(self._buffer, SHARED_SEQUENCE_OFFSET)[1]
+
+    def latest(self):
+        # the newest Sample, None before the first one
+        buffer = self._buffer
+        deadline = None
+        while True:
+            sequence, count = SHARED_SEQUENCE.unpack_from(buffer, SHARED_SEQUENCE_OFFSET)
+            if not sequence & 1:
+                if not count:
+                    return None
+                record = SAMPLE_RECORD.unpack_from(buffer, SHARED_RING_OFFSET + (count - 1) % self.window_size * SAMPLE_RECORD.size)
+                if SHARED_SEQUENCE.unpack_from(buffer, SHARED_SEQUENCE_OFFSET)[0] == sequence:
+                    return unpack_sample(record)
+            deadline = self._wait_for_write(deadline)
+
+    def window(self, last_n=None):
+        # a numpy array (sample_logger.LOG_RECORD_DTYPE) of the last_n samples, at most window_size, the oldest first
+        import numpy as np
+        from sample_logger import LOG_RECORD_DTYPE
+        buffer = self._buffer
+        ring = np.frombuffer(buffer, dtype=LOG_RECORD_DTYPE, count=self.window_size, offset=SHARED_RING_OFFSET)
+        deadline = None
+        while True:
+            sequence, count = SHARED_SEQUENCE.unpack_from(buffer, SHARED_SEQUENCE_OFFSET)
+            if not sequence & 1:
+                length = min(count, self.window_size, self.window_size if last_n is None else last_n)
+                start = (count - length) % self.window_size
+                if start + length <= self.window_size:
+                    records = ring[start:start + length].copy()
+                else:
+                    records = np.concatenate((ring[start:], ring[:start + length - self.window_size]))
+                if SHARED_SEQUENCE.unpack_from(buffer, SHARED_SEQUENCE_OFFSET)[0] == sequence:
+                    return records
+            deadline = self._wait_for_write(deadline)
+
+    def _wait_for_write(self, deadline):
+        # the daemon is in the middle of a write, let it finish. a write that never finishes means the daemon died in it
+        self.retries += 1
+        now = time.perf_counter()
+        if deadline is None:
+            deadline = now + self.write_timeout
+        elif now > deadline:
+            raise TimeoutError(f"the daemon {self.daemon_pid} did not finish its write within {self.write_timeout} s, it probably died")
+        time.sleep(0)
+        return deadline
+
+    def close(self):
+        self._buffer = None
+        self._segment.close()
+
+
+# reads the sample stream of a daemon: async for sample in SampleStreamClient(path): ...
+# the samples carry unix times. a client that falls behind loses the oldest samples in the daemon, like a stream() subscriber
+class SampleStreamClient:
+    def __init__(self, socket_path, read_size=65536):
+        self.socket_path = socket_path
+        self.read_size = read_size
+        self._reader = None
+        self._writer = None
+
+    async def __aenter__(self):
+        await self.connect_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    async def connect_async(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+        magic, version, record_size = STREAM_HEADER.unpack(await self._reader.readexactly(STREAM_HEADER.size))
+        if magic != STREAM_MAGIC or version != STREAM_VERSION or record_size != SAMPLE_RECORD.size:
+            self.close()
+            raise ValueError(f"{self.socket_path} does not serve a supported sample stream")
+
+    def __aiter__(self):
+        return self._read_samples_async()
+
+    async def get_batch_async(self):
+        # every sample that arrived with the next read, an empty list once the daemon closed the stream
+        return [unpack_sample(record) for record in SAMPLE_RECORD.iter_unpack(await self._read_records_async())]
+
+    async def _read_samples_async(self):
+        while True:
+            batch = await self.get_batch_async()
+            if not batch:
+                return
+            for sample in batch:
+                yield sample
+
+    async def _read_records_async(self):
+        data = await self._reader.read(self.read_size)
+        if not data:
+            return b""
+        missing = -len(data) % SAMPLE_RECORD.size
+        if missing:
+            data += await self._reader.readexactly(missing)
+        return data
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+# owns the controller's serial port and serves its samples on socket_path and in the shared memory shared_memory_name.
+# by default both are named after the port, see default_socket_path(); either of them can be switched off with False.
+# a name another running daemon serves raises DaemonNameInUseError, names a crashed daemon left behind are taken over
+class AcquisitionDaemon:
+    def __init__(self, controller, socket_path=None, shared_memory_name=None, window_size=10000,
+                 client_queue_size=10000, batch_size=1000, close_timeout=1.0):
+        self.controller = controller
+        self.socket_path = socket_path
+        self.shared_memory_name = shared_memory_name
+        self.window_size = window_size # samples in the shared memory
+        self.client_queue_size = client_queue_size # samples kept for a slow stream client before its oldest ones are dropped
+        self.batch_size = batch_size # samples per write to a stream client or the shared memory
+        self.close_timeout = close_timeout # seconds the stream clients get to take their last samples when the daemon stops
+        self.shared_samples = None
+        self.clients_served = 0
+        self._client_subscriptions = set()
+        self._client_tasks = set()
+        self._client_writers = set()
+        self._server = None
+        self._shared_memory_task = None
+        self._shared_memory_subscription = None
+        # sample times are time.perf_counter() values, other processes get unix times
+        self._clock_offset = time.time() - time.perf_counter()
+
+    async def __aenter__(self):
+        await self.start_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop_async()
+        return False
+
+    @property
+    def client_count(self):
+        return len(self._client_subscriptions)
+
+    async def start_async(self):
+        if self.controller.ser is None: # the controller searched for the meter until its connection timeout, in vain
+            raise ConnectionError("no meter found, give its port with --port or check the connection")
+        port = self.controller.ser.port
+        if self.socket_path is None:
+            self.socket_path = default_socket_path(port)
+        if self.shared_memory_name is None:
+            self.shared_memory_name = default_shared_memory_name(port)
+        # check both names before taking either
+        if self.socket_path and os.path.exists(self.socket_path):
+            if _is_socket_served(self.socket_path):
+                raise DaemonNameInUseError(f"{self.socket_path} is served by another daemon")
+            os.unlink(self.socket_path) # left behind by a daemon that did not shut down
+        if self.shared_memory_name:
+            check_shared_memory_is_stale(self.shared_memory_name)
+            self.shared_samples = SharedSampleWriter(self.shared_memory_name, self.window_size)
+            self._shared_memory_subscription = self.controller.stream(self.window_size, "drop_oldest")
+            self._shared_memory_task = asyncio.create_task(self._publish_to_shared_memory_async())
+        if self.socket_path:
+            self._server = await asyncio.start_unix_server(self._serve_client_async, self.socket_path)
+        self.controller.start_update_in_background()
+
+    async def stop_async(self):
+        await self.controller.stop_update_async()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError: # already removed
+                pass
+        for subscription in list(self._client_subscriptions):
+            subscription.close() # the client tasks write what is left and end
+        if self._client_tasks:
+            _, pending = await asyncio.wait(set(self._client_tasks), timeout=self.close_timeout)
+            if pending:
+                for writer in list(self._client_writers):
+                    writer.transport.abort() # a client that stopped reading would keep its task in drain() forever
+                await asyncio.wait(pending)
+        if self._shared_memory_task is not None:
+            self._shared_memory_subscription.close()
+            await self._shared_memory_task
+            self._shared_memory_task = None
+            self.shared_samples.close()
+
+    async def serve_forever_async(self):
+        await asyncio.Event().wait()
+
+    async def _publish_to_shared_memory_async(self):
+        subscription = self._shared_memory_subscription
+        while True:
+            batch = await subscription.get_batch_async(self.batch_size)
+            if batch:
+                self.shared_samples.publish([pack_sample(sample, self._clock_offset) for sample in batch])
+            elif subscription.closed:
+                return
+
+    async def _serve_client_async(self, reader, writer):
+        subscription = self.controller.stream(self.client_queue_size, "drop_oldest")
+        self._client_subscriptions.add(subscription)
+        self._client_tasks.add(asyncio.current_task())
+        self._client_writers.add(writer)
+        self.clients_served += 1
+        try:
+            writer.write(STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, SAMPLE_RECORD.size))
+            while True:
+                batch = await subscription.get_batch_async(self.batch_size)
+                if batch:
+                    writer.write(b"".join([pack_sample(sample, self._clock_offset) for sample in batch]))
+                    await writer.drain()
+                elif subscription.closed:
+                    return
+        except ConnectionError:
+            pass # the client went away
+        finally:
+            subscription.close()
+            self._client_subscriptions.discard(subscription)
+            self._client_tasks.discard(asyncio.current_task())
+            self._client_writers.discard(writer)
+            writer.close()
+
+
+async def run_daemon_async(args):
+    controller = DeviceController(args.connection_timeout, backlight_enabled=False, port=args.port, pipeline_window=args.pipeline_window)
+    async with controller, AcquisitionDaemon(controller, args.socket, args.shared_memory, args.window) as daemon:
+        print(f"serving the samples of {controller.ser.port} on {daemon.socket_path} and in the shared memory {daemon.shared_memory_name}")
+        await daemon.serve_forever_async()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="serves the samples of one power meter to many local processes")
+    parser.add_argument("--port", help="serial port of the meter, searched if not given")
+    parser.add_argument("--socket", help="path of the unix socket that streams the samples, named after the port if not given")
+    parser.add_argument("--shared-memory", help="name of the shared memory with the latest samples, named after the port if not given")
+    parser.add_argument("--window", type=int, default=10000, help="number of recent samples kept in the shared memory")
+    parser.add_argument("--pipeline-window", type=int, default=1, help="power requests in flight, see DeviceController")
+    parser.add_argument("--connection-timeout", type=int, default=60, help="seconds to search for the meter")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(run_daemon_async(args))
+    except KeyboardInterrupt:
+        pass
+    except (ConnectionError, DaemonNameInUseError) as error:
+        sys.exit(f"acquisition daemon: {error}")
+
+
+if __name__ == "__main__":
+    main()
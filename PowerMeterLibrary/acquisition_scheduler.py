@@ -0,0 +1,111 @@
+import time
+from collections import deque
+
+from commands import Commands
+
+# every power request returns the optical power plus one group of additional fields
+FIELD_GROUP_COMMANDS = {
+    "adc_frequency": Commands.RETURN_POWER_ADC_FREQUENCY,
+    "wavelength_battery": Commands.RETURN_POWER_WAVELENGTH_BATTERY,
+    "reference_power": Commands.RETURN_POWER_REFERENCE_POWER,
+}
+FIELD_GROUP_FIELDS = {
+    "optical_power": ("optical_power",),
+    "adc_frequency": ("adc_value", "frequency", "power_adjustment_gear"),
+    "wavelength_battery": ("mode", "wavelength", "battery_level"),
+    "reference_power": ("reference_power",),
+}
+FUNCTION_SUB_NR_FIELD_GROUPS = {command.value[2]: group for group, command in FIELD_GROUP_COMMANDS.items()}
+# seconds a field group may get old before it has to be fetched again; the optical power is fetched with every request anyway
+DEFAULT_MAX_AGES = {
+    "adc_frequency": 1.0,
+    "reference_power": 5.0,
+    "wavelength_battery": 30.0,
+}
+
+
+# decides which power request to send next. a field group that exceeded its staleness budget (max age) is fetched
+# with its command, the most overdue group first; if nothing is due the command that has been answered fastest is used.
+# all power commands return the optical power, so it is sampled with every request no matter which one is chosen
+class AcquisitionScheduler:
+    def __init__(self, max_ages=None, rate_window=10.0):
+        self.max_ages = dict(DEFAULT_MAX_AGES, **(max_ages or {}))
+        self.rate_window = rate_window # seconds the effective rates are averaged over
+        self._last_updates = dict.fromkeys(FIELD_GROUP_FIELDS) # group -> time.perf_counter() of its last update
+        self._update_times = {group: deque() for group in FIELD_GROUP_FIELDS}
+        self._response_times = dict.fromkeys(FIELD_GROUP_COMMANDS.values(), 0.0) # command -> smoothed response time in ms
+        self._requested_groups = set() # groups whose request is in flight, so a pipeline does not fetch them twice
+        self._start_time = None
+
+    def next_command(self, now=None):
+        if now is None:
+            now = time.perf_counter()
+        most_overdue_group = None
+        most_overdue = (1.0, 0.0)
+        for group, command in FIELD_GROUP_COMMANDS.items():
+            if group in self._requested_groups:
+                continue
+            last_update = self._last_updates[group]
+            if last_update is None:
+                most_overdue_group = group
+                break
+            age = now - last_update
+            max_age = self.max_ages[group]
+            overdue = (age / max_age if max_age > 0 else float("inf"), age) # the older group wins a tie, so max age 0 round robins
+            if overdue >= most_overdue:
+                most_overdue_group, most_overdue = group, overdue
+        if most_overdue_group is not None:
+            self._requested_groups.add(most_overdue_group)
+            return FIELD_GROUP_COMMANDS[most_overdue_group]
+        return min(self._response_times, key=self._response_times.get) # the cheapest way to get the optical power
+
+    def record_update(self, function_sub_nr, now=None):
+        # called for every decoded power frame
+        if now is None:
+            now = time.perf_counter()
+        self._record_group_update("optical_power", now)
+        group = FUNCTION_SUB_NR_FIELD_GROUPS.get(function_sub_nr)
+        if group is not None:
+            self._requested_groups.discard(group)
+            self._record_group_update(group, now)
+
+    def record_request_failed(self, command):
+        # the request timed out, its group may be chosen again
+        self._requested_groups.discard(FUNCTION_SUB_NR_FIELD_GROUPS.get(command.value[2]))
+
+    def record_response_time(self, command, response_time):
+        # exponentially smoothed, so the cost of a command follows the device
+        if command in self._response_times:
+            previous = self._response_times[command]
+            self._response_times[command] = response_time if previous == 0.0 else previous * 0.9 + response_time * 0.1
+
+    def mark_stale(self, group=None):
+        # e.g. after a display settings change the wavelength or the reference power may be different
+        for name in ([group] if group else FIELD_GROUP_COMMANDS):
+            self._last_updates[name] = None
+
+    def effective_rates(self, now=None):
+        # field -> updates per second within the last rate_window seconds
+        if now is None:
+            now = time.perf_counter()
+        rates = {}
+        duration = min(self.rate_window, now - self._start_time) if self._start_time is not None else 0.0
+        for group, fields in FIELD_GROUP_FIELDS.items():
+            update_times = self._update_times[group]
+            self._forget_old_updates(update_times, now)
+            rate = len(update_times) / duration if duration > 0 else 0.0
+            for field in fields:
+                rates[field] = rate
+        return rates
+
+    def _record_group_update(self, group, now):
+        if self._start_time is None:
+            self._start_time = now
+        self._last_updates[group] = now
+        update_times = self._update_times[group]
+        update_times.append(now)
+        self._forget_old_updates(update_times, now)
+
+    def _forget_old_updates(self, update_times, now):
+        while update_times and now - update_times[0] > self.rate_window:
+            update_times.popleft()
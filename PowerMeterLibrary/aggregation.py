@@ -0,0 +1,276 @@
+import asyncio
+import math
+from collections import deque, namedtuple
+
+from sample_stream import Sample, SampleBroadcaster
+
+
+# the statistics of one window of samples. start and end are time.perf_counter() values like the sample times,
+# std is the population standard deviation like SampleRingBuffer.std()
+class WindowAggregate(namedtuple("WindowAggregate", ("name", "start", "end", "count", "mean", "std", "min", "max"))):
+    __slots__ = ()
+
+
+# mean and variance updated in O(1) per value with Welford's algorithm, numerically stable unlike a sum of squares
+class RunningStatistics:
+    __slots__ = ("count", "mean", "_m2")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        # reverses add(value) for sliding windows
+        if self.count <= 1:
+            self.clear() # also drops the rounding errors the removals accumulated
+            return
+        self.count -= 1
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self._m2 -= delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        return max(self._m2, 0.0) / self.count if self.count else None
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if self.count else None
+
+
+# aggregates one field of the samples in consecutive windows of `seconds`, e.g. 1 s averages. process() returns the
+# aggregate of a window as soon as the first sample of the next one arrives, windows without samples are left out
+class TumblingWindow:
+    def __init__(self, seconds, field="optical_power", name=None):
+        if seconds <= 0:
+            raise ValueError(f"seconds must be positive, not {seconds}")
+        self.seconds = seconds
+        self.field = field
+        self.name = name or f"{field}_{seconds:g}s"
+        self._field_index = Sample._fields.index(field)
+        self._statistics = RunningStatistics()
+        self._start = None
+        self._min = math.inf
+        self._max = -math.inf
+
+    def process(self, sample):
+        value = sample[self._field_index]
+        if value is None:
+            return None
+        window_start = math.floor(sample.time / self.seconds) * self.seconds
+        aggregate = None
+        if window_start != self._start:
+            aggregate = self.flush()
+            self._start = window_start
+        self._statistics.add(value)
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+        return aggregate
+
+    def flush(self):
+        # the aggregate of the current, incomplete window or None; the next sample starts a new one
+        statistics = self._statistics
+        aggregate = None
+        if statistics.count:
+            aggregate = WindowAggregate(self.name, self._start, self._start + self.seconds, statistics.count, statistics.mean,
+                                        statistics.std, self._min, self._max)
+        statistics.clear()
+        self._min = math.inf
+        self._max = -math.inf
+        return aggregate
+
+
+# aggregates one field of the samples of the last `seconds` in O(1) per sample: Welford for mean and variance and
+# monotonic deques for min and max, so every sample enters and leaves each structure once.
+# current() is always up to date; with a step, process() also returns the aggregate every step seconds
+class SlidingWindow:
+    def __init__(self, seconds, step=None, field="optical_power", name=None):
+        if seconds <= 0:
+            raise ValueError(f"seconds must be positive, not {seconds}")
+        if step is not None and step <= 0:
+            raise ValueError(f"step must be positive or None, not {step}")
+        self.seconds = seconds
+        self.step = step
+        self.field = field
+        self.name = name or f"{field}_sliding_{seconds:g}s"
+        self._field_index = Sample._fields.index(field)
+        self._statistics = RunningStatistics()
+        self._values = deque() # (time, value) of the samples in the window
+        self._minima = deque() # the entries of _values that can still become the minimum, increasing values
+        self._maxima = deque() # and the maximum, decreasing values
+        self._next_emit = None
+
+    def process(self, sample):
+        value = sample[self._field_index]
+        if value is None:
+            return None
+        now = sample.time
+        entry = (now, value)
+        self._values.append(entry)
+        self._statistics.add(value)
+        minima = self._minima
+        while minima and minima[-1][1] >= value:
+            minima.pop()
+        minima.append(entry)
+        maxima = self._maxima
+        while maxima and maxima[-1][1] <= value:
+            maxima.pop()
+        maxima.append(entry)
+        self._evict(now - self.seconds)
+        if self.step is None:
+            return None
+        if self._next_emit is None:
+            self._next_emit = (math.floor(now / self.step) + 1) * self.step
+        elif now >= self._next_emit:
+            self._next_emit = (math.floor(now / self.step) + 1) * self.step
+            return self.current()
+        return None
+
+    def current(self):
+        # the aggregate of the samples of the last `seconds` before the newest one, None while the window is empty
+        statistics = self._statistics
+        if not statistics.count:
+            return None
+        end = self._values[-1][0]
+        return WindowAggregate(self.name, end - self.seconds, end, statistics.count, statistics.mean, statistics.std,
+                               self._minima[0][1], self._maxima[0][1])
+
+    def flush(self):
+        return None # a sliding window has nothing pending
+
+    def _evict(self, oldest_time):
+        values = self._values
+        while values[0][0] <= oldest_time:
+            entry = values.popleft()
+            self._statistics.remove(entry[1])
+            if self._minima[0] is entry:
+                self._minima.popleft()
+            if self._maxima[0] is entry:
+                self._maxima.popleft()
+
+
+# lets a sample through only if its field moved more than `db` or more than `microwatt` away from the last sample it
+# let through, e.g. DeadbandFilter(db=0.1) for events on a 0.1 dB change. with max_interval a sample is also let
+# through after that many seconds without one, so consumers can tell a steady signal from a dead meter
+class DeadbandFilter:
+    def __init__(self, db=None, microwatt=None, field="optical_power", max_interval=None):
+        if db is None and microwatt is None:
+            raise ValueError("a deadband needs db, microwatt or both")
+        self.db = db
+        self.microwatt = microwatt
+        self.field = field
+        self.max_interval = max_interval
+        self._field_index = Sample._fields.index(field)
+        self._factor = 10 ** (db / 10) if db is not None else None # a change of db is a ratio, no logarithm per sample
+        self._last_value = None
+        self._last_time = None
+
+    def process(self, sample):
+        value = sample[self._field_index]
+        if value is None:
+            return None
+        last_value = self._last_value
+        if last_value is not None and not self._is_outside(value, last_value) \
+                and (self.max_interval is None or sample.time - self._last_time < self.max_interval):
+            return None
+        self._last_value = value
+        self._last_time = sample.time
+        return sample
+
+    def flush(self):
+        return None
+
+    def _is_outside(self, value, last_value):
+        if self.microwatt is not None and abs(value - last_value) > self.microwatt:
+            return True
+        factor = self._factor
+        if factor is not None:
+            if value <= 0 or last_value <= 0: # no level in dB, any change counts
+                return value != last_value
+            return value > last_value * factor or value * factor < last_value
+        return False
+
+
+# runs the samples of a controller through windows and filters and publishes only what they return, e.g.
+#   reducer = SampleReducer([TumblingWindow(1), TumblingWindow(10), SlidingWindow(10, step=1), DeadbandFilter(db=0.1)])
+#   reducer.start(controller)
+#   with reducer.stream() as reduced:
+#       async for item in reduced: # WindowAggregate records and the samples the filters let through
+# the stages see every sample in a batch from one stream() subscription, consumers only get the reduced stream
+class SampleReducer:
+    def __init__(self, stages, batch_size=1000, queue_size=100000):
+        self.stages = stages
+        self.batch_size = batch_size
+        self.samples_processed = 0
+        self.items_published = 0
+        self._queue_size = queue_size
+        self._broadcaster = SampleBroadcaster()
+        self._subscription = None
+        self._task = None
+        self._stop_event = asyncio.Event()
+
+    @property
+    def dropped(self):
+        # samples lost because the stages could not keep up
+        return self._subscription.dropped if self._subscription else 0
+
+    def stream(self, maxsize=1000, overflow="drop_oldest"):
+        # like DeviceController.stream(); with 'block' a slow consumer holds the reducer back, not the acquisition
+        return self._broadcaster.subscribe(maxsize, overflow)
+
+    def start(self, controller):
+        self._stop_event.clear()
+        self._subscription = controller.stream(self._queue_size, "drop_oldest")
+        self._task = asyncio.create_task(self._reduce_async())
+
+    async def stop_async(self):
+        # processes what is left, publishes the incomplete tumbling windows and closes the reduced streams.
+        # a 'block' consumer that stopped reading no longer holds the reducer back, it loses what does not fit
+        self._stop_event.set()
+        if self._subscription is not None:
+            self._subscription.close()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        for stage in self.stages:
+            self._publish(stage.flush())
+        for subscription in list(self._broadcaster.subscriptions):
+            subscription.close()
+
+    def process(self, samples):
+        # runs a batch of samples through all stages, also usable on samples that did not come from a controller
+        publish = self._publish
+        stages = self.stages
+        for sample in samples:
+            for stage in stages:
+                item = stage.process(sample)
+                if item is not None:
+                    publish(item)
+        self.samples_processed += len(samples)
+
+    def _publish(self, item):
+        if item is not None:
+            self.items_published += 1
+            self._broadcaster.publish(item)
+
+    async def _reduce_async(self):
+        subscription = self._subscription
+        while True:
+            await self._broadcaster.wait_for_capacity_async(self._stop_event)
+            batch = await subscription.get_batch_async(self.batch_size)
+            if batch:
+                self.process(batch)
+            elif subscription.closed:
+                return
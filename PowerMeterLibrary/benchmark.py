@@ -0,0 +1,955 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+
+from serial.tools.list_ports_common import ListPortInfo
+
+from DataProcessingStrategies.StrategyLoader import DataProcessingStrategyLoader
+from acquisition_daemon import AcquisitionDaemon, SampleStreamClient, SharedSampleReader
+from aggregation import DeadbandFilter, SampleReducer, SlidingWindow, TumblingWindow
+from device_controller import DeviceController
+from commands import Commands, CommandTypes
+from fleet import PowerMeterFleet
+from frame_decoder import FrameDecoder
+from helpers import convert_number_to_wavelength, extract_number
+from metrics import MetricsExporter
+from sample_buffer import SampleRingBuffer
+from sample_logger import SampleLogReader, SampleLogWriter
+from sample_stream import Sample, SampleBroadcaster
+from simulated_device import SimulatedPowerMeter
+from traffic_capture import DIRECTION_RECEIVED, ReplaySerial, TrafficRecorder, read_capture, replay_into
+
+# performance benchmarks of the controller against the simulated power meter, e.g.
+#   python benchmark.py throughput --samples 2000 --transport pty
+#   python benchmark.py all --json benchmark_results.json
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def create_meter(args):
+    return SimulatedPowerMeter(response_delay=args.delay, jitter=args.jitter, drop_rate=args.drop_rate,
+                               corrupt_rate=args.corrupt_rate, baudrate=args.baudrate, seed=1)
+
+
+def open_simulated_port(meter, args):
+    return meter.open_pty() if args.transport == "pty" else meter.open_serial()
+
+
+@contextlib.contextmanager
+def quiet():
+    # the controller reports connects and errors with print, which would drown the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+async def bench_throughput_async(args):
+    with create_meter(args) as meter:
+        with quiet():
+            async with DeviceController(backlight_enabled=False, port=open_simulated_port(meter, args)) as controller:
+                response_times = []
+                cpu_start = time.process_time()
+                start = time.perf_counter()
+                for _ in range(args.samples):
+                    await controller.update_async()
+                    response_times.append(controller.device_response_time)
+                duration = time.perf_counter() - start
+                cpu_time = time.process_time() - cpu_start
+    return {
+        "samples_per_second": args.samples / duration,
+        "p50_response_ms": percentile(response_times, 0.5),
+        "p99_response_ms": percentile(response_times, 0.99),
+        "cpu_us_per_sample": cpu_time / args.samples * 1e6,
+    }
+
+
+async def bench_connect_async(args):
+    connect_times = []
+    with create_meter(args) as meter:
+        port = open_simulated_port(meter, args) if args.transport == "pty" else None
+        for _ in range(args.repeat):
+            controller = DeviceController(backlight_enabled=False, port=port or meter.open_serial())
+            with quiet():
+                start = time.perf_counter()
+                await controller.__aenter__()
+                connect_times.append((time.perf_counter() - start) * 1000)
+                await controller.__aexit__(None, None, None)
+    return {
+        "p50_connect_ms": percentile(connect_times, 0.5),
+        "max_connect_ms": max(connect_times),
+    }
+
+
+class CandidatePortsController(DeviceController):
+    # searches the given ports instead of the ones of this host
+    def __init__(self, candidate_ports, **kwargs):
+        super().__init__(**kwargs)
+        self._candidate_ports = candidate_ports
+
+    def _list_candidate_ports(self):
+        return self._candidate_ports
+
+
+def open_decoy_ports(count):
+    # serial ports that never answer, like the other USB-serial adapters of a lab host
+    import pty
+    import tty
+    decoys = []
+    for _ in range(count):
+        master, slave = pty.openpty()
+        tty.setraw(slave) # no echo of the probe request
+        decoys.append((master, slave, ListPortInfo(os.ttyname(slave), skip_link_detection=True)))
+    return decoys
+
+
+async def bench_discovery_async(args):
+    if args.transport != "pty":
+        return {"skipped": "port discovery needs the pty transport"}
+    results = {}
+    with create_meter(args) as meter, tempfile.TemporaryDirectory() as cache_dir:
+        meter_port = ListPortInfo(meter.open_pty(), skip_link_detection=True)
+        meter_port.vid, meter_port.pid, meter_port.serial_number = 0x1A86, 0x7523, "SIM0001"
+        for decoy_count in args.decoys:
+            decoys = open_decoy_ports(decoy_count)
+            candidates = [decoy[2] for decoy in decoys] + [meter_port] # the meter is the last port the host lists
+            cache_file = os.path.join(cache_dir, f"port_cache_{decoy_count}.json")
+            for run in ("cold", "cached"):
+                controller = CandidatePortsController(candidates, backlight_enabled=False, port_cache_file=cache_file)
+                with quiet():
+                    start = time.perf_counter()
+                    await controller.__aenter__()
+                    results[f"{run}_connect_ms_{decoy_count}_decoys"] = (time.perf_counter() - start) * 1000
+                    await controller.__aexit__(None, None, None)
+                    await asyncio.sleep(controller._probe_timeout) # let the decoy probes time out before the decoys vanish
+            for master, slave, _ in decoys:
+                os.close(master)
+                os.close(slave)
+    return results
+
+
+async def bench_fleet_async(args):
+    # a real meter needs a while to answer, without a delay this would only measure the CPU
+    delay = args.delay or 0.02
+    results = {"device_delay_ms": delay * 1000}
+    for meter_count in args.meters:
+        meters = [SimulatedPowerMeter(response_delay=delay, jitter=args.jitter, drop_rate=args.drop_rate,
+                                      corrupt_rate=args.corrupt_rate, baudrate=args.baudrate, seed=index)
+                  for index in range(meter_count)]
+        with quiet():
+            async with PowerMeterFleet([open_simulated_port(meter, args) for meter in meters]) as fleet:
+                fleet.start_update_in_background()
+                await asyncio.sleep(args.duration)
+                await fleet.stop_update_async()
+                samples = sum(fleet.sample_counts.values())
+        for meter in meters:
+            meter.close()
+        results[f"samples_per_second_{meter_count}_meters"] = samples / args.duration
+    return results
+
+
+POWER_COMMANDS = (Commands.RETURN_POWER_WAVELENGTH_BATTERY, Commands.RETURN_POWER_ADC_FREQUENCY, Commands.RETURN_POWER_REFERENCE_POWER)
+
+
+def record_traffic(frame_count, seed=1):
+    # the responses of a simulated meter to the controller's round robin of power requests
+    meter = SimulatedPowerMeter(noise=0.2, seed=seed)
+    return b"".join(meter.handle_request(POWER_COMMANDS[index % 3].value) for index in range(frame_count))
+
+
+def corrupt_traffic(traffic, rate, seed=1):
+    # inserts, drops and flips single bytes, like a noisy line or a replugged cable would
+    generator = random.Random(seed)
+    corrupted = bytearray()
+    for byte in traffic:
+        if generator.random() >= rate:
+            corrupted.append(byte)
+            continue
+        damage = generator.randrange(3)
+        if damage == 0:
+            corrupted += bytes((generator.randrange(256), byte))
+        elif damage == 2:
+            corrupted.append(byte ^ generator.randrange(1, 256))
+    return bytes(corrupted)
+
+
+def feed_in_chunks(traffic, feed, seed=1):
+    generator = random.Random(seed)
+    offset = 0
+    while offset < len(traffic):
+        size = generator.randrange(1, 257)
+        feed(traffic[offset:offset + size])
+        offset += size
+
+
+async def bench_decoder_async(args):
+    frame_count = int(args.megabytes * 1e6) // 13
+    traffic = record_traffic(frame_count)
+    results = {"megabytes": len(traffic) / 1e6}
+
+    decoder = FrameDecoder()
+    start = time.perf_counter()
+    feed_in_chunks(traffic, lambda chunk: decoder.feed(chunk, len))
+    duration = time.perf_counter() - start
+    if decoder.frames_decoded != frame_count or decoder.discarded_bytes:
+        raise RuntimeError(f"clean traffic: decoded {decoder.frames_decoded} of {frame_count} frames, discarded {decoder.discarded_bytes} bytes")
+    results["clean_frames_per_second"] = frame_count / duration
+    results["clean_megabytes_per_second"] = len(traffic) / 1e6 / duration
+
+    corrupted = corrupt_traffic(traffic, args.corruption)
+    decoder = FrameDecoder()
+    start = time.perf_counter()
+    feed_in_chunks(corrupted, lambda chunk: decoder.feed(chunk, len))
+    duration = time.perf_counter() - start
+    # every damaged byte may cost the frame it hit and, after a false start, the following one
+    damaged_bytes = int(len(traffic) * args.corruption * 3) + 100
+    if decoder.frames_decoded < frame_count - 2 * damaged_bytes:
+        raise RuntimeError(f"corrupted traffic: only decoded {decoder.frames_decoded} of {frame_count} frames")
+    results["corrupted_frames_per_second"] = decoder.frames_decoded / duration
+    results["corrupted_frames_recovered"] = decoder.frames_decoded / frame_count
+    results["corrupted_discarded_bytes"] = decoder.discarded_bytes
+    results["corrupted_resyncs"] = decoder.resyncs
+
+    # the whole receive path including the strategies
+    controller = DeviceController(port_cache_file=None)
+    start = time.perf_counter()
+    feed_in_chunks(traffic, controller._on_data_received)
+    duration = time.perf_counter() - start
+    results["controller_frames_per_second"] = controller.frame_decoder.frames_decoded / duration
+    return results
+
+
+# the strategies as they were before the dispatch table and the struct layouts, as baseline: every field read with
+# extract_number and the strategy found by asking each one in turn with an exact applies_to
+class LinearSearchStrategy:
+    def __init__(self, function_nr, function_sub_id, process_data):
+        self.function_nr = function_nr
+        self.function_sub_id = function_sub_id
+        self.process_data = process_data
+
+    def applies_to(self, function_nr, function_sub_id):
+        return self.function_nr == function_nr and self.function_sub_id == function_sub_id
+
+
+def process_display_settings_changed(controller, data):
+    controller._is_display_settings_changed = True
+
+
+def process_optical_power_and_adc(controller, data):
+    controller.optical_power = extract_number(data, 5, 9)
+    controller.adc_value = extract_number(data, 9, 11)
+    controller.frequency = extract_number(data, 11, 12)
+    controller.power_adjustment_gear = extract_number(data, 12, 13)
+
+
+def process_optical_power_and_reference_power(controller, data):
+    controller.optical_power = extract_number(data, 5, 9)
+    controller.reference_power = extract_number(data, 9, 13)
+
+
+def process_optical_power_and_wavelength(controller, data):
+    controller.optical_power = extract_number(data, 5, 9)
+    controller.mode = extract_number(data, 9, 10)
+    controller.wavelength = convert_number_to_wavelength(extract_number(data, 10, 11))
+    controller.battery_level = (extract_number(data, 11, 12) + 1) * 25
+
+
+# in the order the old loader found them, the modules of the package sorted by name
+LINEAR_SEARCH_STRATEGIES = [LinearSearchStrategy(0x02, 0, process_display_settings_changed),
+                            LinearSearchStrategy(1, 0, process_optical_power_and_adc),
+                            LinearSearchStrategy(1, 1, process_optical_power_and_reference_power),
+                            LinearSearchStrategy(1, 0x80, process_optical_power_and_wavelength)]
+
+
+def apply_strategy_by_linear_search(controller, data):
+    function_nr = extract_number(data, 1, 2)
+    function_sub_id = extract_number(data, 2, 3)
+    for strategy in LINEAR_SEARCH_STRATEGIES:
+        if strategy.applies_to(function_nr, function_sub_id):
+            strategy.process_data(controller, data)
+            return True
+    return False
+
+
+async def bench_strategies_async(args):
+    traffic = record_traffic(args.samples * 100)
+    frames = [traffic[offset:offset + 13] for offset in range(0, len(traffic), 13)]
+    controller = DeviceController(port_cache_file=None)
+    baseline_controller = DeviceController(port_cache_file=None)
+    results = {}
+    for name, apply in (("linear_search", lambda frame: apply_strategy_by_linear_search(baseline_controller, frame)),
+                        ("dispatch_table", controller._apply_strategy)):
+        start = time.perf_counter()
+        for frame in frames:
+            apply(frame)
+        results[f"{name}_frames_per_second"] = len(frames) / (time.perf_counter() - start)
+    if (baseline_controller.optical_power, baseline_controller.reference_power, baseline_controller.wavelength) != \
+            (controller.optical_power, controller.reference_power, controller.wavelength):
+        raise RuntimeError("the linear search decoded other values than the dispatch table")
+    results["speedup"] = results["dispatch_table_frames_per_second"] / results["linear_search_frames_per_second"]
+    return results
+
+
+class LatencyRecordingController(DeviceController):
+    # remembers the round trip of every power request, pipelined or not
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.response_times = []
+
+    async def update_async(self, timeout=2):
+        is_received = await super().update_async(timeout)
+        if is_received:
+            self.response_times.append(self.device_response_time)
+        return is_received
+
+    async def _request_power_async(self, command):
+        is_received = await super()._request_power_async(command)
+        if is_received:
+            self.response_times.append(self.device_response_time)
+        return is_received
+
+
+async def bench_pipeline_async(args):
+    # the pipeline pays off on a slow line, so the real meter's 9600 baud are simulated unless told otherwise
+    delay = args.delay or 0.02
+    baudrate = args.baudrate or 9600
+    results = {"device_delay_ms": delay * 1000, "baudrate": baudrate}
+    for window in args.windows:
+        meter = SimulatedPowerMeter(response_delay=delay, jitter=args.jitter, drop_rate=args.drop_rate,
+                                    corrupt_rate=args.corrupt_rate, baudrate=baudrate, seed=1)
+        with meter, quiet():
+            controller = LatencyRecordingController(backlight_enabled=False, port=open_simulated_port(meter, args),
+                                                    pipeline_window=window, request_timeout=1)
+            async with controller:
+                controller.start_update_in_background()
+                await asyncio.sleep(args.duration)
+                await controller.stop_update_async()
+        results[f"window_{window}_samples_per_second"] = len(controller.response_times) / args.duration
+        results[f"window_{window}_p50_response_ms"] = percentile(controller.response_times, 0.5)
+        results[f"window_{window}_p99_response_ms"] = percentile(controller.response_times, 0.99)
+    return results
+
+
+async def bench_scheduler_async(args):
+    # the wavelength/battery request is answered slower here, like a device that measures its battery first
+    delay = args.delay or 0.01
+    results = {}
+    round_robin = dict.fromkeys(("adc_frequency", "wavelength_battery", "reference_power"), 0)
+    for name, max_ages in (("round_robin", round_robin), ("scheduled", None)):
+        meter = SimulatedPowerMeter(response_delay=delay, power_request_delays={0x80: delay * 3}, baudrate=args.baudrate, seed=1)
+        with meter, quiet():
+            async with DeviceController(backlight_enabled=False, port=open_simulated_port(meter, args), field_max_ages=max_ages) as controller:
+                controller.acquisition_scheduler.rate_window = args.duration
+                controller.start_update_in_background()
+                await asyncio.sleep(args.duration)
+                rates = controller.acquisition_scheduler.effective_rates()
+                await controller.stop_update_async()
+        for field in ("optical_power", "adc_value", "reference_power", "battery_level"):
+            results[f"{name}_{field}_per_second"] = rates[field]
+    return results
+
+
+async def bench_history_async(args):
+    history = SampleRingBuffer(args.samples * 100)
+    count = history.capacity * 2 # wrap around once
+    start = time.perf_counter()
+    for index in range(count):
+        history.append(index * 0.01, 1.5, 512, 0, 1, 1550, 100, 1.0)
+    results = {"appends_per_second": count / (time.perf_counter() - start)}
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        history.statistics(last_n=history.capacity // 2, dbm=True)
+    results["statistics_ms_half_buffer"] = (time.perf_counter() - start) / args.repeat * 1000
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        history.mean(seconds=10)
+    results["mean_ms_last_10_seconds"] = (time.perf_counter() - start) / args.repeat * 1000
+    return results
+
+
+async def bench_stream_async(args):
+    results = {}
+    for subscriber_count in args.subscribers:
+        latencies = []
+
+        async def consume(subscription):
+            with subscription:
+                async for sample in subscription:
+                    latencies.append((time.perf_counter() - sample.time) * 1000)
+
+        with create_meter(args) as meter, quiet():
+            async with DeviceController(backlight_enabled=False, port=open_simulated_port(meter, args)) as controller:
+                consumers = [asyncio.create_task(consume(controller.stream(overflow=args.overflow))) for _ in range(subscriber_count)]
+                controller.start_update_in_background()
+                await asyncio.sleep(args.duration)
+                await controller.stop_update_async()
+                for subscription in list(controller._sample_broadcaster.subscriptions):
+                    subscription.close()
+                await asyncio.gather(*consumers)
+        samples = controller.frame_decoder.frames_decoded
+        results[f"{subscriber_count}_subscribers_samples_per_second"] = samples / args.duration
+        # what the acquisition itself pays per sample, without the consumers sharing its event loop
+        broadcaster = SampleBroadcaster()
+        for _ in range(subscriber_count):
+            broadcaster.subscribe(maxsize=100)
+        sample = Sample(0.0, 0, 1.5, 512, 0, 1, 0, 1550, 100, 1.0)
+        start = time.perf_counter()
+        for _ in range(10000):
+            broadcaster.publish(sample)
+        results[f"{subscriber_count}_subscribers_publish_us_per_sample"] = (time.perf_counter() - start) / 10000 * 1e6
+        if subscriber_count:
+            results[f"{subscriber_count}_subscribers_p50_delivery_ms"] = percentile(latencies, 0.5)
+            results[f"{subscriber_count}_subscribers_p99_delivery_ms"] = percentile(latencies, 0.99)
+    return results
+
+
+async def bench_logging_async(args):
+    count = args.samples * 1000
+    samples = [Sample(index * 0.01, 0x80, 1.5, 512, 0, 1, 0, 1550, 100, 1.0) for index in range(10000)]
+    results = {"samples": count}
+    with tempfile.TemporaryDirectory() as directory:
+        writer = SampleLogWriter(directory)
+        start = time.perf_counter()
+        for _ in range(count // len(samples)):
+            writer.write_samples(samples)
+        writer._close_file()
+        results["written_samples_per_second"] = writer.samples_written / (time.perf_counter() - start)
+        results["file_megabytes"] = os.path.getsize(writer.files[0]) / 1e6
+        start = time.perf_counter()
+        reader = SampleLogReader(writer.files[0])
+        power = reader["optical_power"]
+        results["open_ms"] = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        power.mean()
+        results["column_mean_ms"] = (time.perf_counter() - start) * 1000
+        del power, reader
+    return results
+
+
+async def replay_capture_async(capture, **replay_options):
+    # returns the controller and the seconds it took to decode the whole capture
+    replay_port = ReplaySerial(capture, **replay_options)
+    with quiet():
+        async with DeviceController(backlight_enabled=False, port=replay_port, port_cache_file=None) as controller:
+            start = time.perf_counter()
+            while not replay_port.finished:
+                await asyncio.sleep(0.001)
+            await asyncio.sleep(0) # the last read is handed to the event loop
+            duration = time.perf_counter() - start
+    return controller, duration
+
+
+async def bench_replay_async(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # a capture of a real polling session against the simulated meter
+        session_capture = os.path.join(directory, "session.pmcap")
+        with create_meter(args) as meter, quiet():
+            async with DeviceController(backlight_enabled=False, port=open_simulated_port(meter, args)) as controller:
+                controller.start_traffic_capture(session_capture)
+                start = time.perf_counter()
+                controller.start_update_in_background()
+                await asyncio.sleep(args.duration)
+                await controller.stop_update_async()
+                session_duration = time.perf_counter() - start
+        captured_frames = controller.frame_decoder.frames_decoded
+        results["session_frames"] = captured_frames
+
+        replayed, duration = await replay_capture_async(session_capture, realtime=True)
+        if replayed.frame_decoder.frames_decoded != captured_frames or replayed.optical_power != controller.optical_power:
+            raise RuntimeError(f"realtime replay decoded {replayed.frame_decoder.frames_decoded} of {captured_frames} frames")
+        results["realtime_replay_duration_ratio"] = duration / session_duration
+
+        # a large capture, replayed as fast as possible
+        traffic = record_traffic(int(args.megabytes * 1e6) // 13)
+        bulk_capture = os.path.join(directory, "bulk.pmcap")
+        recorder = TrafficRecorder(bulk_capture)
+        feed_in_chunks(traffic, lambda chunk: recorder.record(DIRECTION_RECEIVED, chunk))
+        recorder.close()
+        frame_count = len(traffic) // 13
+        results["bulk_frames"] = frame_count
+
+        replayed, duration = await replay_capture_async(bulk_capture)
+        if replayed.frame_decoder.frames_decoded != frame_count:
+            raise RuntimeError(f"fast replay decoded {replayed.frame_decoder.frames_decoded} of {frame_count} frames")
+        results["replay_serial_frames_per_second"] = frame_count / duration
+
+        controller = DeviceController(port_cache_file=None, history_size=0)
+        start = time.perf_counter()
+        replay_into(controller, bulk_capture)
+        results["replay_into_frames_per_second"] = frame_count / (time.perf_counter() - start)
+
+        chunks = [data for _, direction, data in read_capture(bulk_capture) if direction == DIRECTION_RECEIVED]
+        decoder = FrameDecoder()
+        start = time.perf_counter()
+        for chunk in chunks:
+            decoder.feed(chunk, len)
+        results["decoder_only_frames_per_second"] = frame_count / (time.perf_counter() - start)
+    return results
+
+
+async def bench_iothread_async(args):
+    # another task blocks the event loop for load_ms at a time, like a GUI redraw or a slow HTTP handler would
+    delay = args.delay or 0.01
+    results = {"device_delay_ms": delay * 1000, "loop_blocked_ms": args.load_ms}
+
+    async def load_event_loop(stop_event):
+        while not stop_event.is_set():
+            time.sleep(args.load_ms / 1000)
+            await asyncio.sleep(0.001)
+
+    # the delivery delay is taken on the event loop, from the sample time to the subscriber receiving the sample. with the
+    # io thread the sample time is the arrival of the frame, without it the frame is only stamped once the loop decodes it,
+    # so there the time the frame waited for a blocked loop shows in the response times instead
+    async def consume(subscription, latencies):
+        with subscription:
+            async for sample in subscription:
+                latencies.append((time.perf_counter() - sample.time) * 1000)
+
+    for mode, io_thread in (("event_loop", False), ("io_thread", True)):
+        for loaded in (False, True):
+            meter = SimulatedPowerMeter(response_delay=delay, jitter=args.jitter, baudrate=args.baudrate, seed=1)
+            name = f"{mode}_{'loaded' if loaded else 'idle'}"
+            with meter, quiet():
+                controller = LatencyRecordingController(backlight_enabled=False, port=open_simulated_port(meter, args), io_thread=io_thread)
+                async with controller:
+                    stop_event = asyncio.Event()
+                    load = asyncio.create_task(load_event_loop(stop_event)) if loaded else None
+                    latencies = []
+                    consumer = asyncio.create_task(consume(controller.stream(maxsize=100000), latencies))
+                    controller.start_update_in_background()
+                    await asyncio.sleep(args.duration)
+                    await controller.stop_update_async()
+                    stop_event.set()
+                    if load is not None:
+                        await load
+                    for subscription in list(controller._sample_broadcaster.subscriptions):
+                        subscription.close()
+                    await consumer
+            results[f"{name}_samples_per_second"] = len(controller.response_times) / args.duration
+            results[f"{name}_p50_delivery_ms"] = percentile(latencies, 0.5)
+            results[f"{name}_p99_delivery_ms"] = percentile(latencies, 0.99)
+            results[f"{name}_p50_response_ms"] = percentile(controller.response_times, 0.5)
+            results[f"{name}_p99_response_ms"] = percentile(controller.response_times, 0.99)
+    return results
+
+
+class DiscardingPort:
+    # takes the requests of a controller whose responses are fed in directly
+    port = "discard"
+
+    def write(self, data):
+        return len(data)
+
+
+async def bench_metrics_async(args):
+    count = args.samples * 100
+    meter = SimulatedPowerMeter(seed=1)
+    responses = {command: meter.handle_request(command.value) for command in POWER_COMMANDS}
+    results = {"request_cycles": count}
+    cycle_times = {False: [], True: []}
+    for _ in range(5): # alternating, so a frequency change of the CPU hits both alike
+        for enabled in (False, True):
+            controller = DeviceController(port_cache_file=None, history_size=0, metrics=enabled)
+            controller.ser = DiscardingPort()
+            start = time.perf_counter()
+            for index in range(count):
+                command = POWER_COMMANDS[index % 3]
+                controller.send_command(command)
+                controller._on_data_received(responses[command])
+            cycle_times[enabled].append((time.perf_counter() - start) / count * 1e6)
+    results["disabled_us_per_request"] = min(cycle_times[False])
+    results["enabled_us_per_request"] = min(cycle_times[True])
+    results["enabled_overhead_percent"] = (min(cycle_times[True]) / min(cycle_times[False]) - 1) * 100
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        controller.metrics.snapshot()
+    results["snapshot_us"] = (time.perf_counter() - start) / 1000 * 1e6
+
+    exporter = MetricsExporter({"bench": controller}, port=0)
+    await exporter.start_async()
+    try:
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection(exporter.host, exporter.port)
+        writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        results["exporter_scrape_ms"] = (time.perf_counter() - start) * 1000
+    finally:
+        await exporter.stop_async()
+    if b"powermeter_request_latency_milliseconds_count" not in response:
+        raise RuntimeError(f"unexpected exporter response {response[:200]!r}")
+    results["exporter_response_bytes"] = len(response)
+    return results
+
+
+def measure_import(module):
+    # cumulative import time of module in a fresh interpreter, as reported by python -X importtime, in ms
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}, sys; print('numpy' in sys.modules)"],
+                             cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    for line in process.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1000, process.stdout.strip() == "True"
+    raise RuntimeError(f"no import time reported for {module}: {process.stderr[-500:]}")
+
+
+async def bench_construction_async(args):
+    results = {}
+    import_times = []
+    for _ in range(5):
+        import_time, numpy_imported = measure_import("device_controller")
+        import_times.append(import_time)
+    results["import_ms"] = min(import_times)
+    results["import_loads_numpy"] = numpy_imported
+
+    for name, build in (("scan_package", lambda: DataProcessingStrategyLoader("DataProcessingStrategies", "DataProcessingStrategy")),
+                        ("builtin_only", lambda: DataProcessingStrategyLoader("DataProcessingStrategies", "DataProcessingStrategy", scan_package=False))):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            build()
+        results[f"loader_{name}_ms"] = (time.perf_counter() - start) / args.repeat * 1000
+
+    count = args.samples
+    for name, options in (("loader_per_controller", lambda: {"strategy_loader": DataProcessingStrategyLoader("DataProcessingStrategies", "DataProcessingStrategy")}),
+                          ("shared_loader", lambda: {}),
+                          ("shared_loader_no_history", lambda: {"history_size": 0})):
+        start = time.perf_counter()
+        for _ in range(count):
+            DeviceController(port_cache_file=None, **options())
+        results[f"{name}_per_second"] = count / (time.perf_counter() - start)
+    return results
+
+
+async def bench_eeprom_async(args):
+    # downloads the stored records of a simulated meter at 9600 baud, unless told otherwise, and checks every value
+    baudrate = args.baudrate or 9600
+    delay = args.delay or 0.002
+    stored_records = [round(random.Random(index).uniform(0.001, 2000.0), 3) for index in range(args.samples)]
+    frame_seconds = 13 * 10 / baudrate
+    results = {"records": len(stored_records), "baudrate": baudrate,
+               "wire_minimum_seconds": len(stored_records) * max(frame_seconds, delay)}
+    # baseline: one round trip per record
+    with SimulatedPowerMeter(stored_records=stored_records, response_delay=delay, baudrate=baudrate, seed=1) as meter, quiet():
+        async with DeviceController(backlight_enabled=False, port=open_simulated_port(meter, args)) as controller:
+            start = time.perf_counter()
+            for index in range(len(stored_records)):
+                await controller.read_eeprom_async(index * 4)
+            results["round_trip_per_record_seconds"] = time.perf_counter() - start
+    for window in args.windows:
+        for drop_rate in (0.0, args.drop_rate or 0.05): # the values are also checked with lost answers, unless told otherwise 5%
+            meter = SimulatedPowerMeter(stored_records=stored_records, response_delay=delay, drop_rate=drop_rate, baudrate=baudrate, seed=1)
+            name = f"window_{window}" + (f"_drop_{drop_rate:g}" if drop_rate else "")
+            with meter, quiet():
+                async with DeviceController(backlight_enabled=False, port=open_simulated_port(meter, args)) as controller:
+                    download = controller.download_stored_records(window=window, timeout=0.2, retries=5)
+                    start = time.perf_counter()
+                    records = await download.read_all_async()
+                    duration = time.perf_counter() - start
+            powers = [record.optical_power for record in records]
+            expected = [float(struct.unpack("<f", struct.pack("<f", value))[0]) for value in stored_records]
+            if powers != expected or [record.index for record in records] != list(range(len(stored_records))):
+                raise RuntimeError(f"{name}: downloaded records differ from the stored ones")
+            results[f"{name}_seconds"] = duration
+            results[f"{name}_records_per_second"] = len(records) / duration
+            if drop_rate:
+                results[f"{name}_repeated_reads"] = download.reads_repeated
+    return results
+
+
+async def bench_commands_async(args):
+    # several callers turn on the backlight every 200 ms while the background update polls at 9600 baud, unless told
+    # otherwise: once through the command queue (execute_command_async) and once written directly with send_command
+    baudrate = args.baudrate or 9600
+    delay = args.delay or 0.01
+    callers = 8
+    results = {"baudrate": baudrate, "device_delay_ms": delay * 1000, "display_callers": callers}
+
+    async def poll_async(display_mode):
+        meter = SimulatedPowerMeter(response_delay=delay, jitter=args.jitter, drop_rate=args.drop_rate, baudrate=baudrate, seed=1)
+        latencies = []
+        failed = 0
+        with meter, quiet():
+            controller = LatencyRecordingController(backlight_enabled=False, port=open_simulated_port(meter, args))
+            display_sent = 0
+            send_command = controller.send_command
+
+            def counting_send_command(command):
+                nonlocal display_sent
+                display_sent += command is Commands.TURN_ON_LED_BACKLIGHT
+                return send_command(command)
+            controller.send_command = counting_send_command
+
+            async def caller_async(stop_event, seed):
+                nonlocal failed
+                await asyncio.sleep(random.Random(seed).uniform(0, 0.2))
+                while not stop_event.is_set():
+                    start = time.perf_counter()
+                    if display_mode == "queue":
+                        is_answered = await controller.execute_command_async(Commands.TURN_ON_LED_BACKLIGHT, timeout=1, retries=1, attempt_timeout=0.5)
+                    else:
+                        response_future = controller.send_command(Commands.TURN_ON_LED_BACKLIGHT)
+                        is_answered = await controller._wait_for_request_async(response_future, CommandTypes.DISPLAY_SETTINGS_CHANGE, 1)
+                    if is_answered:
+                        latencies.append((time.perf_counter() - start) * 1000)
+                    else:
+                        failed += 1
+                    await asyncio.sleep(0.2)
+
+            async with controller:
+                stop_event = asyncio.Event()
+                tasks = [asyncio.create_task(caller_async(stop_event, seed)) for seed in range(callers if display_mode else 0)]
+                controller.start_update_in_background()
+                await asyncio.sleep(args.duration)
+                stop_event.set()
+                await controller.stop_update_async()
+                await asyncio.gather(*tasks)
+                queue = controller.command_queue
+        name = display_mode or "polling_alone"
+        results[f"{name}_samples_per_second"] = len(controller.response_times) / args.duration
+        if display_mode:
+            results[f"{name}_display_answered"] = len(latencies)
+            results[f"{name}_display_failed"] = failed
+            results[f"{name}_display_sent"] = display_sent
+            results[f"{name}_display_p50_ms"] = percentile(latencies, 0.5)
+            results[f"{name}_display_p99_ms"] = percentile(latencies, 0.99)
+        if display_mode == "queue":
+            results["queue_commands_merged"] = queue.commands_merged
+
+    for display_mode in (None, "direct", "queue"):
+        await poll_async(display_mode)
+    return results
+
+
+def read_shared_samples(name, duration, poll_interval, ready, start, results):
+    # one reader process of the daemon benchmark: reads as fast as it can for half of the duration, then polls for new
+    # samples every poll_interval seconds and measures how long after their arrival at the daemon it saw them
+    with SharedSampleReader(name) as reader:
+        ready.put(True)
+        start.wait()
+        reads = 0
+        end = time.perf_counter() + duration / 2
+        while time.perf_counter() < end:
+            reader.latest()
+            reads += 1
+        latencies = []
+        last_count = reader.count
+        end = time.perf_counter() + duration / 2
+        while time.perf_counter() < end:
+            if reader.count != last_count:
+                sample = reader.latest()
+                latencies.append((time.time() - sample.time) * 1000)
+                last_count = reader.count
+            time.sleep(poll_interval)
+        results.put((reads / (duration / 2), latencies, reader.retries))
+
+
+def read_stream_samples(socket_path, duration, ready, start, results):
+    # one stream client process of the daemon benchmark
+    async def read_async():
+        samples = 0
+        latencies = []
+        async with SampleStreamClient(socket_path) as client:
+            ready.put(True)
+            await asyncio.to_thread(start.wait)
+            end = time.perf_counter() + duration
+            while time.perf_counter() < end:
+                batch = await asyncio.wait_for(client.get_batch_async(), duration)
+                samples += len(batch)
+                latencies.append((time.time() - batch[-1].time) * 1000)
+        results.put((samples / duration, latencies, 0))
+    asyncio.run(read_async())
+
+
+async def bench_daemon_async(args):
+    # dozens of processes read the samples of one simulated meter from the acquisition daemon, once from its shared
+    # memory and once over its unix socket. the reader processes compete with the daemon for the CPUs of this host
+    import multiprocessing
+    if args.transport != "pty":
+        return {"skipped": "the reader processes need the pty transport"}
+    context = multiprocessing.get_context("spawn")
+    delay = args.delay or 0.002
+    results = {"device_delay_ms": delay * 1000, "cpus": os.cpu_count()}
+    with tempfile.TemporaryDirectory() as socket_dir:
+        socket_path = os.path.join(socket_dir, "powermeter.sock")
+        shared_memory_name = f"powermeter_benchmark_{os.getpid()}"
+        for kind in ("shm", "stream"):
+            for readers in args.readers:
+                meter = SimulatedPowerMeter(response_delay=delay, baudrate=args.baudrate, seed=1)
+                with meter, quiet():
+                    controller = DeviceController(backlight_enabled=False, port=open_simulated_port(meter, args), history_size=0)
+                    async with controller, AcquisitionDaemon(controller, socket_path, shared_memory_name) as daemon:
+                        ready, start, queue = context.Queue(), context.Event(), context.Queue()
+                        if kind == "shm":
+                            target, target_args = read_shared_samples, (shared_memory_name, args.duration, 0.001)
+                        else:
+                            target, target_args = read_stream_samples, (socket_path, args.duration)
+                        processes = [context.Process(target=target, args=target_args + (ready, start, queue)) for _ in range(readers)]
+                        for process in processes:
+                            process.start()
+                        for _ in processes:
+                            await asyncio.to_thread(ready.get)
+                        count_before = daemon.shared_samples.count
+                        start.set()
+                        reader_results = [await asyncio.to_thread(queue.get) for _ in processes]
+                        published = (daemon.shared_samples.count - count_before) / args.duration
+                    for process in processes:
+                        process.join()
+                rates = [rate for rate, _, _ in reader_results]
+                latencies = [latency for _, reader_latencies, _ in reader_results for latency in reader_latencies]
+                name = f"{kind}_{readers}_readers"
+                results[f"{name}_daemon_samples_per_second"] = published
+                results[f"{name}_{'reads' if kind == 'shm' else 'samples'}_per_second"] = sum(rates)
+                results[f"{name}_p50_latency_ms"] = percentile(latencies, 0.5)
+                results[f"{name}_p99_latency_ms"] = percentile(latencies, 0.99)
+                if kind == "shm":
+                    results[f"{name}_seqlock_retries"] = sum(retries for _, _, retries in reader_results)
+    return results
+
+
+def synthetic_samples(count, rate=1000.0):
+    # a noisy signal around 1.5 μW with a step every 10000 samples, at `rate` samples per second
+    rng = random.Random(1)
+    return [Sample(index / rate, 0x80, (1.5 + 0.5 * (index // 10000 % 2)) * (1 + rng.gauss(0, 0.002)), 512, 0, 1, 0, 1550, 100, 1.0)
+            for index in range(count)]
+
+
+async def bench_aggregation_async(args):
+    # O(1) windows and deadband filtering per sample against what a consumer pays recomputing them from the raw samples,
+    # and a check of the aggregates against numpy
+    import numpy as np
+    count = args.samples * 200
+    samples = synthetic_samples(count)
+    results = {"samples": count}
+    stages = {
+        "tumbling_1s": lambda: TumblingWindow(1),
+        "sliding_10s": lambda: SlidingWindow(10, step=1),
+        "deadband_0.1db": lambda: DeadbandFilter(db=0.1),
+        "deadband_0.01uw": lambda: DeadbandFilter(microwatt=0.01),
+    }
+    for name, create_stage in stages.items():
+        reducer = SampleReducer([create_stage()])
+        start = time.perf_counter()
+        reducer.process(samples)
+        results[f"{name}_us_per_sample"] = (time.perf_counter() - start) / count * 1e6
+        results[f"{name}_items"] = reducer.items_published
+    reducer = SampleReducer([TumblingWindow(1), TumblingWindow(10), SlidingWindow(10, step=1), DeadbandFilter(db=0.1)])
+    start = time.perf_counter()
+    reducer.process(samples)
+    results["all_stages_us_per_sample"] = (time.perf_counter() - start) / count * 1e6
+    results["all_stages_items"] = reducer.items_published
+    results["reduction_factor"] = count / reducer.items_published
+    # a consumer that updates a 1 s window of the raw samples from scratch for every sample, here for 10000 of them
+    values = deque(maxlen=1000)
+    start = time.perf_counter()
+    for sample in samples[:10000]:
+        values.append(sample.optical_power)
+        window = np.fromiter(values, float, len(values))
+        window.mean(), window.std(), window.min(), window.max()
+    results["recomputing_consumer_us_per_sample"] = (time.perf_counter() - start) / 10000 * 1e6
+
+    times = np.array([sample.time for sample in samples])
+    power = np.array([sample.optical_power for sample in samples])
+    tumbling = TumblingWindow(1)
+    aggregates = [aggregate for aggregate in map(tumbling.process, samples) if aggregate is not None] + [tumbling.flush()]
+    error = 0.0
+    for aggregate in aggregates:
+        values = power[(times >= aggregate.start) & (times < aggregate.end)]
+        error = max(error, abs(aggregate.mean - values.mean()), abs(aggregate.std - values.std()),
+                    abs(aggregate.min - values.min()), abs(aggregate.max - values.max()))
+    results["tumbling_max_error_uw"] = error
+    sliding = SlidingWindow(10)
+    error = 0.0
+    for index, sample in enumerate(samples):
+        sliding.process(sample)
+        if index % 997 == 0:
+            aggregate = sliding.current()
+            values = power[(times > sample.time - 10) & (times <= sample.time)]
+            error = max(error, abs(aggregate.mean - values.mean()), abs(aggregate.std - values.std()),
+                        abs(aggregate.min - values.min()), abs(aggregate.max - values.max()))
+    results["sliding_max_error_uw"] = error
+    return results
+
+
+BENCHMARKS = {
+    "aggregation": bench_aggregation_async,
+    "daemon": bench_daemon_async,
+    "commands": bench_commands_async,
+    "eeprom": bench_eeprom_async,
+    "construction": bench_construction_async,
+    "metrics": bench_metrics_async,
+    "iothread": bench_iothread_async,
+    "replay": bench_replay_async,
+    "logging": bench_logging_async,
+    "stream": bench_stream_async,
+    "history": bench_history_async,
+    "scheduler": bench_scheduler_async,
+    "pipeline": bench_pipeline_async,
+    "strategies": bench_strategies_async,
+    "decoder": bench_decoder_async,
+    "fleet": bench_fleet_async,
+    "discovery": bench_discovery_async,
+    "throughput": bench_throughput_async,
+    "connect": bench_connect_async,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PowerMeterLibrary benchmarks against a simulated FHP2A04 power meter")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS) + ["all"])
+    parser.add_argument("--samples", type=int, default=1000, help="power samples per measurement")
+    parser.add_argument("--repeat", type=int, default=20, help="repetitions of one-shot measurements like connecting")
+    parser.add_argument("--transport", choices=["pty", "loop"], default="pty" if sys.platform != "win32" else "loop")
+    parser.add_argument("--delay", type=float, default=0.0, help="simulated device response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="additional random response delay in seconds")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability of an unanswered request")
+    parser.add_argument("--corrupt-rate", type=float, default=0.0, help="probability of a corrupted response")
+    parser.add_argument("--baudrate", type=int, default=None, help="simulate the wire time of this baud rate")
+    parser.add_argument("--decoys", type=lambda text: [int(count) for count in text.split(",")], default=[0, 4, 16],
+                        help="comma separated numbers of silent ports next to the meter for the discovery benchmark")
+    parser.add_argument("--meters", type=lambda text: [int(count) for count in text.split(",")], default=[1, 2, 4, 8, 16],
+                        help="comma separated numbers of simulated meters for the fleet benchmark")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds of polling for time based benchmarks")
+    parser.add_argument("--windows", type=lambda text: [int(count) for count in text.split(",")], default=[1, 2, 3, 4, 8],
+                        help="comma separated pipeline windows for the pipeline benchmark")
+    parser.add_argument("--subscribers", type=lambda text: [int(count) for count in text.split(",")], default=[0, 1, 10, 100],
+                        help="comma separated numbers of stream subscribers for the stream benchmark")
+    parser.add_argument("--readers", type=lambda text: [int(count) for count in text.split(",")], default=[1, 8, 32],
+                        help="comma separated numbers of reader processes for the daemon benchmark")
+    parser.add_argument("--overflow", choices=["drop_oldest", "drop_newest", "block"], default="drop_oldest",
+                        help="overflow policy of the stream subscribers")
+    parser.add_argument("--load-ms", type=float, default=20.0, help="how long the iothread benchmark blocks the event loop at a time")
+    parser.add_argument("--megabytes", type=float, default=4.0, help="amount of recorded traffic for the decoder benchmark")
+    parser.add_argument("--corruption", type=float, default=0.001, help="probability of a damaged byte in the decoder benchmark")
+    parser.add_argument("--json", help="write the results to this file, e.g. for CI")
+    args = parser.parse_args(argv)
+
+    names = sorted(BENCHMARKS) if args.benchmark == "all" else [args.benchmark]
+    results = {}
+    for name in names:
+        results[name] = asyncio.run(BENCHMARKS[name](args))
+        print(f"{name}:")
+        for key, value in results[name].items():
+            print(f"  {key:<36} {value:.3f}" if isinstance(value, float) else f"  {key:<36} {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+import time
+
+from commands import Commands, CommandTypes
+
+PRIORITY_USER = 0 # display settings and other commands somebody is waiting for
+PRIORITY_BACKGROUND = 10 # the power polling of the background update
+# these commands step through a setting, two of them are not the same as one and must never be merged
+TOGGLING_COMMANDS = frozenset((
+    Commands.SWITCH_WAVELENGTH_GEAR_AND_READ_REFERENCE_POWER,
+    Commands.SWITCH_OPTICAL_POWER_UNIT_TO_UW,
+    Commands.SWITCH_TO_VIEW_REFERENCE_VALUE_MODE,
+    Commands.SWITCH_LED_BACKLIGHT,
+))
+
+
+class CommandQueueClosedError(Exception):
+    pass
+
+
+def _fail(result, error):
+    result.set_exception(error)
+    result.exception() # a caller that was cancelled meanwhile never looks at it, asyncio would log it as never retrieved
+
+
+class QueuedCommand:
+    def __init__(self, command, priority, deadline, retries, attempt_timeout, sequence):
+        self.command = command
+        self.priority = priority
+        self.deadline = deadline # time.perf_counter() after which the command is given up
+        self.retries = retries
+        self.attempt_timeout = attempt_timeout
+        self.sequence = sequence # keeps the order of commands with the same priority
+        self.result = asyncio.get_running_loop().create_future() # shared by all callers that got merged into this command
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+# the only writer of the controller's requests, see DeviceController.execute_command_async.
+# commands wait here until fewer than max_in_flight requests of their priority are on the line, the most urgent first.
+# every priority has its own max_in_flight: the responses are matched per function, so a display command never waits
+# for the polling and the polling keeps its pace while display commands are sent.
+# a command that is already waiting to be sent is not queued twice, its callers share the response.
+# the result of every command is the round trip of its answered attempt in ms, 0.0 for commands without response
+# and None if it was not answered before its deadline. errors of the port, e.g. an unplugged meter, are raised to the caller
+class CommandQueue:
+    def __init__(self, controller, max_in_flight=1, attempt_timeout=2):
+        self.max_in_flight = max_in_flight # per priority
+        self.attempt_timeout = attempt_timeout # default seconds one attempt may take
+        self.commands_sent = 0
+        self.commands_merged = 0 # commands that were already waiting and got answered together with them
+        self._controller = controller
+        self._pending = [] # few commands, the most urgent one is found with min()
+        self._waiting = {} # command -> its QueuedCommand until it is sent
+        self._in_flight = {} # priority -> requests on the line
+        self._sequence = itertools.count()
+        self._sending = set() # tasks of the commands in flight
+        self._closed = False
+
+    def open(self):
+        # called by the controller once its port is open again
+        self._closed = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, command: Commands, priority=PRIORITY_USER, timeout=2, retries=1, attempt_timeout=None, merge=True):
+        # returns a future with the result of the command. timeout is the deadline for all attempts together.
+        # merge=False always sends the command, e.g. the pipelined polling that wants several of the same requests on the line
+        merge = merge and command not in TOGGLING_COMMANDS
+        queued = self._waiting.get(command) if merge else None
+        if queued is not None:
+            self.commands_merged += 1
+            queued.priority = min(queued.priority, priority)
+            queued.deadline = max(queued.deadline, time.perf_counter() + timeout)
+            queued.retries = max(queued.retries, retries)
+            return queued.result
+        queued = QueuedCommand(command, priority, time.perf_counter() + timeout, retries,
+                               attempt_timeout or self.attempt_timeout, next(self._sequence))
+        if self._closed:
+            _fail(queued.result, CommandQueueClosedError(f"{command.name} was not sent, the port is closed"))
+            return queued.result
+        self._pending.append(queued)
+        if merge:
+            self._waiting[command] = queued
+        self._send_next()
+        return queued.result
+
+    def close(self):
+        # fails the waiting commands and the ones in flight, and every command submitted until open() is called
+        self._closed = True
+        for task in self._sending:
+            task.cancel()
+        for queued in self._pending:
+            if not queued.result.done():
+                _fail(queued.result, CommandQueueClosedError(f"{queued.command.name} was not sent, the port got closed"))
+        self._pending.clear()
+        self._waiting.clear()
+
+    def _send_next(self):
+        # called whenever a command is added or a request left the line, no task has to wake up for it
+        while True:
+            queued = min((queued for queued in self._pending if self._in_flight.get(queued.priority, 0) < self.max_in_flight), default=None)
+            if queued is None:
+                return
+            self._pending.remove(queued)
+            if self._waiting.get(queued.command) is queued:
+                del self._waiting[queued.command]
+            if time.perf_counter() >= queued.deadline:
+                queued.result.set_result(None) # waited too long behind more urgent commands
+                continue
+            self._in_flight[queued.priority] = self._in_flight.get(queued.priority, 0) + 1
+            task = asyncio.create_task(self._send_with_retries_async(queued))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send_with_retries_async(self, queued):
+        controller = self._controller
+        round_trip = None
+        try:
+            for attempt in range(queued.retries + 1):
+                remaining = queued.deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                if attempt and controller.metrics is not None:
+                    controller.metrics.record_retry(queued.command)
+                send_time = time.perf_counter()
+                response_future = controller.send_command(queued.command)
+                self.commands_sent += 1
+                if response_future is None:
+                    round_trip = 0.0 # nothing to wait for
+                    break
+                try:
+                    frame_time = await asyncio.wait_for(asyncio.shield(response_future), min(queued.attempt_timeout, remaining))
+                except asyncio.TimeoutError:
+                    controller._discard_response_waiter(response_future)
+                    if controller.metrics is not None:
+                        controller.metrics.record_timeout(CommandTypes(queued.command.value[1]))
+                    continue
+                round_trip = (frame_time - send_time) * 1000
+                break
+        except Exception as error: # the port is closed or gone, a retry would not help
+            if not queued.result.done():
+                _fail(queued.result, error)
+        finally:
+            if not queued.result.done():
+                if self._closed:
+                    _fail(queued.result, CommandQueueClosedError(f"{queued.command.name} got no answer, the port got closed"))
+                else:
+                    queued.result.set_result(round_trip)
+            self._in_flight[queued.priority] -= 1
+            self._send_next()
@@ -25,4 +25,6 @@ class Commands(Enum):
 @unique 
 class CommandTypes (Enum):
     POWER_REQUEST = 0x01  # a request of type "please send me the power" is being sent.
-    DISPLAY_SETTINGS_CHANGE = 0x02  # a request is being sent to please change the device's internal display settings
\ No newline at end of file
+    DISPLAY_SETTINGS_CHANGE = 0x02  # a request is being sent to please change the device's internal display settings
+    READ_EEPROM = 0x20  # reads some bytes of the eeprom, e.g. a stored power record
+    STORED_RECORD_COUNT = 0x22  # asks for the number of stored power records
\ No newline at end of file
@@ -23,8 +23,7 @@ async def handle_console(controller, input):
     elif (input == "stop"):
         controller.do_print_data = False
     elif (input == "light"):
-        controller.send_command(Commands.SWITCH_LED_BACKLIGHT)
-        if await controller.wait_for_display_settings_change(1) == True:
+        if await controller.execute_command_async(Commands.SWITCH_LED_BACKLIGHT, 1) == True:
             print("light has changed")
         else:
             print("error")
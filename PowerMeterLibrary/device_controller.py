@@ -1,14 +1,35 @@
 import asyncio
 import serial
+import threading
 import time
-import serial.tools.list_ports
+from collections import deque
 
-from DataProcessingStrategies.StrategyLoader import DataProcessingStrategyLoader
+from DataProcessingStrategies.StrategyLoader import get_strategy_loader
+from acquisition_scheduler import AcquisitionScheduler
+from command_queue import PRIORITY_BACKGROUND, PRIORITY_USER, CommandQueue
 from commands import CommandTypes, Commands
+from eeprom_download import StoredRecordDownload
+from frame_decoder import FrameDecoder
 from helpers import extract_number
+from metrics import ControllerMetrics
+from port_cache import DEFAULT_PORT_CACHE_FILE, PortCache
+from sample_stream import Sample, SampleBroadcaster
+from traffic_capture import DIRECTION_RECEIVED, DIRECTION_SENT, TrafficRecorder
 
 class DeviceController:
-    def __init__(self, connectionTimeout = 60, backlight_enabled = True):
+    # port: optional port name or pyserial url (e.g. a simulated meter's pty) or an already opened serial port object.
+    # if it is not given, all serial ports are searched for the device, starting with the one cached in port_cache_file (None disables the cache)
+    # pipeline_window > 1 lets the background update keep that many power requests in flight instead of waiting for every response
+    # field_max_ages: seconds the additional values may get old before they are fetched again, see acquisition_scheduler.DEFAULT_MAX_AGES
+    # history_size: number of samples kept in self.history for statistics over the last N samples or T seconds, 0 disables it
+    # io_thread: read and decode in a dedicated thread that hands the frames with their arrival time to the event loop in batches,
+    # so a busy event loop neither delays the reads nor inflates the sample times and device_response_time
+    # metrics: collect latency histograms, timeouts, retries and buffer depths in self.metrics, see metrics.ControllerMetrics
+    # strategy_loader: where the response processing strategies come from, by default one loader shared by all controllers of the process
+    # that finds the strategies of the DataProcessingStrategies folder; get_strategy_loader(scan_package=False) skips the folder scan
+    def __init__(self, connectionTimeout = 60, backlight_enabled = True, port = None, port_cache_file = DEFAULT_PORT_CACHE_FILE, probe_timeout = 0.3,
+                 pipeline_window = 1, request_timeout = 2, request_retries = 1, field_max_ages = None, history_size = 10000, io_thread = False,
+                 metrics = False, strategy_loader = None):
         self.optical_power = None
         self.reference_power = None
         self.adc_value = None
@@ -17,9 +38,19 @@ class DeviceController:
         self.mode = None
         self.wavelength = None
         self.battery_level = None
+        self.stored_record_count = None
+        self.eeprom_value = None # the bytes of the last eeprom read
+        self.eeprom_function_return_value = None
         self.do_print_data = False
         self.device_response_time = 0
-        self._data_processing_strategies = DataProcessingStrategyLoader("DataProcessingStrategies" , "DataProcessingStrategy").strategies # load all response processing strategies from folder
+        self.last_sample_time = None # time.perf_counter() of the last received optical power
+        self._history_size = history_size
+        self._history = None # created by the history property on first use, see there
+        self._sample_broadcaster = SampleBroadcaster() # feeds the subscriptions of stream()
+        if strategy_loader is None:
+            strategy_loader = get_strategy_loader("DataProcessingStrategies" , "DataProcessingStrategy") # load all response processing strategies from folder, once per process
+        self._data_processing_strategies = strategy_loader.strategies
+        self._strategy_dispatch_table = strategy_loader.dispatch_table
         self._connection_timeout = connectionTimeout
         self._is_display_settings_changed = None
         self._is_power_data_received = None
@@ -27,9 +58,27 @@ class DeviceController:
         self._update_stop_event.set()
         self._update_task = None
         self._backlight_enabled = backlight_enabled
-        self._command_variation = 0 # in the update function it loops from 0 to 2 to use the 3 different power fetching commands
-        self._buffer = bytearray()  # Persistent buffer to accumulate data
-        self._expected_length = 13
+        self.acquisition_scheduler = AcquisitionScheduler(field_max_ages) # picks the power command of every update, see effective_rates()
+        self._pipeline_window = pipeline_window
+        self._request_timeout = request_timeout # per request in pipelined mode
+        self._request_retries = request_retries # how often a pipelined request is sent again after a timeout
+        # sends all requests, display commands before the power polling, with at most pipeline_window of them on the line
+        self.command_queue = CommandQueue(self, max_in_flight=pipeline_window, attempt_timeout=request_timeout)
+        self.frame_decoder = FrameDecoder() # keeps the incomplete frames between reads and counts discarded bytes and resyncs
+        self.ser = None
+        self._port = port
+        self._port_cache = PortCache(port_cache_file) if port_cache_file else None
+        self._probe_timeout = probe_timeout # how long a probed port may take to answer
+        self._loop = None
+        self._reader_fd = None # set while the event loop watches the port's file descriptor
+        self._reader_thread = None # used instead of the fd watcher where the port has no selectable file descriptor
+        self._io_thread = io_thread
+        self._received_frames = deque() # (arrival time, frame) decoded by the io thread, waiting for the event loop
+        self._is_frame_handoff_scheduled = False
+        self._eeprom_answers = deque(maxlen=1024) # (function_nr, function return value, value) of eeprom reads and record counts in arrival order, see StoredRecordDownload
+        self._response_waiters = [] # pending [function_nr, function_sub_nr, future, command, send time] entries, resolved in request order when the matching frame got decoded
+        self._traffic_recorder = None # set while the raw traffic is captured, see start_traffic_capture()
+        self.metrics = ControllerMetrics(self) if metrics else None
     
     @property
     def optical_power(self):
@@ -38,8 +87,18 @@ class DeviceController:
     @optical_power.setter
     def optical_power(self, value):
         self._optical_power = value
+        self.last_sample_time = time.perf_counter()
         self._is_power_data_received = True  # set that variable to true to mark that a value has been received - in case we want to wait for this specific value
 
+    @property
+    def history(self):
+        # the ring buffer is only allocated, and numpy only imported, once the first sample arrives or someone asks for it,
+        # so controllers that never acquire, e.g. to read the eeprom, are cheap to build
+        if self._history is None and self._history_size:
+            from sample_buffer import SampleRingBuffer # imports numpy, which takes longer than everything else of the library together
+            self._history = SampleRingBuffer(self._history_size)
+        return self._history
+
     async def __aenter__(self):
         await self._connect_to_device_async()
         if(self._backlight_enabled):
@@ -52,6 +111,56 @@ class DeviceController:
         self._close_serial_port()
         return False
     
+    # async for sample in controller.stream(): ... gives every consumer its own bounded queue of Sample records.
+    # overflow: 'drop_oldest', 'drop_newest' or 'block' (the acquisition waits until this consumer caught up)
+    def stream(self, maxsize=1000, overflow="drop_oldest"):
+        return self._sample_broadcaster.subscribe(maxsize, overflow)
+
+    # writes every sent and received chunk of raw bytes with its timestamp to path, e.g. to replay it later with traffic_capture.ReplaySerial
+    def start_traffic_capture(self, path):
+        self.stop_traffic_capture()
+        self._traffic_recorder = TrafficRecorder(path)
+        return self._traffic_recorder
+
+    def stop_traffic_capture(self):
+        if self._traffic_recorder is not None:
+            self._traffic_recorder.close()
+            self._traffic_recorder = None
+
+    # async for record in controller.download_stored_records(): ... reads all power records the meter stored,
+    # see eeprom_download.StoredRecordDownload for the options
+    def download_stored_records(self, window=8, retries=3, timeout=1.0, **options):
+        return StoredRecordDownload(self, window, retries, timeout, **options)
+
+    # returns the number of stored power records or None if the meter did not answer; timeout is per attempt
+    async def read_stored_record_count_async(self, timeout=2, retries=0):
+        if not await self.execute_command_async(Commands.RETURNS_THE_NUMBER_OF_STORED_POWER_RECORDS, timeout * (retries + 1), retries, timeout):
+            return None
+        return self.stored_record_count
+
+    # returns up to 8 bytes of the eeprom starting at address or None if the meter did not answer
+    async def read_eeprom_async(self, address, byte_count=4, timeout=2):
+        response_future = self.send_eeprom_read(address, byte_count)
+        if not await self._wait_for_request_async(response_future, CommandTypes.READ_EEPROM, timeout):
+            return None
+        answer = response_future.result() # the answer to this very read, see _process_frame
+        answers = self._eeprom_answers
+        for index, entry in enumerate(answers): # answered here, not part of a download
+            if entry is answer:
+                del answers[index]
+                break
+        return answer[2]
+
+    async def _wait_for_request_async(self, response_future, command_type, timeout):
+        try:
+            await asyncio.wait_for(asyncio.shield(response_future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            self._discard_response_waiter(response_future)
+            if self.metrics is not None:
+                self.metrics.record_timeout(command_type)
+            return False
+
     def start_update_in_background(self):
         if self._update_task is None or self._update_task.done():
             # Zurücksetzen des Stop-Events, um die Schleife in `update` laufen zu lassen
@@ -67,23 +176,68 @@ class DeviceController:
             self._update_task = None
 
     async def update_looped_async(self):
+        if self._pipeline_window > 1:
+            await self._update_pipelined_looped_async()
+            return
         while not self._update_stop_event.is_set():
+            await self._sample_broadcaster.wait_for_capacity_async(self._update_stop_event)
+            if self._update_stop_event.is_set():
+                break
             await self.update_async()
-            await asyncio.sleep(0.001)
-
-    async def update_async(self):
-        start_time = time.perf_counter()
-        self._command_variation = (self._command_variation +1) % 3
-        # fetch the power but use a variety of those commands to get the additional data as well like battery power, reference power etc.
-        if self._command_variation == 0:
-            self.send_command(Commands.RETURN_POWER_WAVELENGTH_BATTERY)
-        elif self._command_variation == 1:
-            self.send_command(Commands.RETURN_POWER_ADC_FREQUENCY)
-        elif self._command_variation == 2:
-            self.send_command(Commands.RETURN_POWER_REFERENCE_POWER)
-        await self.wait_for_power_data_change_async(2)
-        end_time = time.perf_counter()
-        self.device_response_time = (end_time - start_time) *1000
+            await asyncio.sleep(0) # only yield to other tasks, the response wait above does not poll anymore
+
+    async def _update_pipelined_looped_async(self):
+        # keeps up to pipeline_window power requests outstanding; the responses are matched to them by
+        # function sub number and arrival order, so the serial line never idles while the device is working
+        in_flight = set()
+        while not self._update_stop_event.is_set():
+            await self._sample_broadcaster.wait_for_capacity_async(self._update_stop_event)
+            if self._update_stop_event.is_set():
+                break
+            while len(in_flight) < self._pipeline_window:
+                in_flight.add(asyncio.create_task(self._request_power_async(self.acquisition_scheduler.next_command())))
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            errors = [task.exception() for task in done if task.exception() is not None]
+            if errors: # e.g. the port got closed: end the update like the unpipelined loop does
+                for request in in_flight:
+                    request.cancel()
+                raise errors[0]
+        if in_flight:
+            await asyncio.wait(in_flight)
+
+    async def _request_power_async(self, command):
+        return await self._poll_power_async(command, self._request_timeout * (self._request_retries + 1), self._request_retries)
+
+    # returns False if the device did not answer within timeout seconds
+    async def update_async(self, timeout=2):
+        # every power command returns the power, the scheduler picks the one whose additional values are due
+        return await self._poll_power_async(self.acquisition_scheduler.next_command(), timeout, 0)
+
+    async def _poll_power_async(self, command, timeout, retries):
+        # polling has the lowest priority, commands of the user are sent first. every poll is sent, a pipelined window
+        # asks for the same power command several times
+        try:
+            round_trip = await asyncio.shield(self.command_queue.submit(command, PRIORITY_BACKGROUND, timeout, retries, merge=False))
+        except BaseException: # cancelled or the port failed, the group of the command must not stay marked as requested
+            self.acquisition_scheduler.record_request_failed(command)
+            raise
+        if round_trip is None:
+            self.acquisition_scheduler.record_request_failed(command)
+            return False
+        # measured from sending to the arrival of the response, not to the time this task got to run again
+        self.device_response_time = round_trip
+        self.acquisition_scheduler.record_response_time(command, round_trip)
+        self._is_power_data_received = False # this response is consumed here
+        self._print_data()
+        return True
+
+    # sends the command before any waiting power polling and returns whether the device answered it before timeout seconds,
+    # retrying it up to `retries` times. a command that is already waiting to be sent is not sent twice, both callers get its answer
+    async def execute_command_async(self, command: Commands, timeout=2, retries=1, attempt_timeout=None) -> bool:
+        round_trip = await asyncio.shield(self.command_queue.submit(command, PRIORITY_USER, timeout, retries, attempt_timeout))
+        return round_trip is not None
+
+    def _print_data(self):
         if(self.do_print_data == True):
             print(f"{(self.device_response_time):.2f} ms > power: {self.optical_power} μW \t λ: {self.wavelength} nm \t🔋 {self.battery_level} \tADC: {self.adc_value} \t ref_pwr: {self.reference_power} ")
 
@@ -92,35 +246,69 @@ class DeviceController:
             command = Commands.TURN_ON_LED_BACKLIGHT
         else:
             command = Commands.TURN_OFF_LED_BACKLIGHT
-        self.send_command(command)
-        if await self.wait_for_display_settings_change_async(0.25) == False: # send again if timeout occured
-            self.send_command(command)
+        await self.execute_command_async(command, timeout=0.5, retries=1, attempt_timeout=0.25) # sent again if the first attempt times out
 
-    async def _find_device_port_async(self):
-        available_ports = serial.tools.list_ports.comports()
-        for port in available_ports:
-            
-            print(f"Trying port: {port.device}")
-            try:
-                ser = serial.Serial(port.device, 9600, timeout=1)
+    def _list_candidate_ports(self):
+        import serial.tools.list_ports # only needed to search for the device, not when the port is given
+        return serial.tools.list_ports.comports()
+
+    def _probe_port(self, device):
+        # runs in a worker thread: read returns as soon as the 13 byte answer is there instead of sleeping a fixed time
+        print(f"Trying port: {device}")
+        try:
+            with serial.serial_for_url(device, 9600, timeout=self._probe_timeout) as ser:
                 ser.write(Commands.RETURN_POWER_ADC_FREQUENCY.value)  # Send command
-                await asyncio.sleep(0.3)
-                if ser.in_waiting < 13:
-                    ser.close()
-                    continue
                 received_data = ser.read(13)  # Read response
-                ser.close()  # Close the serial connection
-                if self._validate_data(received_data , CommandTypes.POWER_REQUEST.value , 0x00):
-                    print(f"Successful response from port: {port.device}")
-                    return port.device
-            except serial.SerialException as e:
-                print(f"Error connecting to port {port.device}: {e}")
-            except DataValidationError as data_ex:
-                print(f"could not read data from port {port.device}: {data_ex}")
-        print("No proper response received from any port.")
+            if self._validate_data(received_data , CommandTypes.POWER_REQUEST.value , 0x00):
+                print(f"Successful response from port: {device}")
+                return device
+        except serial.SerialException as e:
+            print(f"Error connecting to port {device}: {e}")
+        except DataValidationError as data_ex:
+            print(f"could not read data from port {device}: {data_ex}")
         return None
 
+    async def _probe_ports_async(self, devices, first_only=True):
+        # probes all ports at the same time and returns the first one that answers properly, or a list of all of them
+        if not devices:
+            return None if first_only else []
+        import concurrent.futures
+        loop = asyncio.get_running_loop()
+        # an own pool, the default executor has too few threads to probe a host full of adapters at once
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(devices), thread_name_prefix="PowerMeterProbe")
+        probes = [loop.run_in_executor(executor, self._probe_port, device) for device in devices]
+        try:
+            if not first_only:
+                return [device for device in await asyncio.gather(*probes) if device is not None]
+            for probe in asyncio.as_completed(probes):
+                device = await probe
+                if device is not None:
+                    return device
+        finally:
+            executor.shutdown(wait=False) # the remaining probes time out on their own and close their ports
+        return None
+
+    async def _find_device_port_async(self):
+        available_ports = self._list_candidate_ports()
+        cached_device = self._port_cache.find_cached_port(available_ports) if self._port_cache else None
+        if cached_device is not None and await self._probe_ports_async([cached_device]):
+            return cached_device
+
+        device = await self._probe_ports_async([port.device for port in available_ports if port.device != cached_device])
+        if device is None:
+            print("No proper response received from any port.")
+            return None
+        if self._port_cache:
+            self._port_cache.store(next(port for port in available_ports if port.device == device))
+        return device
+
     async def _connect_to_device_async(self):
+        if self._port is not None:
+            self.ser = serial.serial_for_url(self._port, 9600, timeout=1) if isinstance(self._port, str) else self._port
+            self._start_reader()
+            self.command_queue.open()
+            print(f"Connected to device on port: {self.ser.port}")
+            return
         start_time = time.time()
         port = None
         while port is None:
@@ -130,6 +318,8 @@ class DeviceController:
             port = await self._find_device_port_async()
             if port:
                 self.ser = serial.Serial(port, 9600, timeout=1)
+                self._start_reader()
+                self.command_queue.open()
                 print(f"Connected to device on port: {port}")
                 break
             else:
@@ -137,9 +327,86 @@ class DeviceController:
                 await asyncio.sleep(0.5)
 
     def _close_serial_port(self):
+        self.command_queue.close()
+        self._stop_reader()
+        self.stop_traffic_capture()
         if self.ser is not None:
             self.ser.close()
 
+    def _start_reader(self):
+        # instead of polling the port every few milliseconds the event loop calls us as soon as bytes arrive
+        self._loop = asyncio.get_running_loop()
+        if self._io_thread:
+            self._reader_fd = None
+            self._reader_thread = threading.Thread(target=self._read_and_decode_in_thread, name="PowerMeterIO", daemon=True)
+            self._reader_thread.start()
+            return
+        try:
+            self._reader_fd = self.ser.fileno()
+            self._loop.add_reader(self._reader_fd, self._on_serial_readable)
+        except (AttributeError, NotImplementedError, OSError, ValueError):
+            # Windows com ports, the ProactorEventLoop and pyserial url handlers offer no selectable fd -> block on the port in a thread
+            self._reader_fd = None
+            self._reader_thread = threading.Thread(target=self._read_serial_in_thread, name="PowerMeterReader", daemon=True)
+            self._reader_thread.start()
+
+    def _stop_reader(self):
+        if self._reader_fd is not None:
+            self._loop.remove_reader(self._reader_fd)
+            self._reader_fd = None
+        self._reader_thread = None # closing the port ends the thread's blocking read
+
+    def _is_reader_running(self):
+        return self._reader_fd is not None or (self._reader_thread is not None and self._reader_thread.is_alive())
+
+    def _on_serial_readable(self):
+        try:
+            # the fd is readable, so reading at least one byte does not block
+            data = self.ser.read(max(1, self.ser.in_waiting))
+        except serial.SerialException as e:
+            print(f"Error reading from port {self.ser.port}: {e}")
+            self._stop_reader()
+            return
+        self._on_data_received(data)
+
+    def _read_serial_in_thread(self):
+        ser = self.ser
+        while ser.is_open:
+            try:
+                data = ser.read(max(1, ser.in_waiting)) # returns as soon as one byte arrived or the port timeout elapsed
+                if data:
+                    self._loop.call_soon_threadsafe(self._on_data_received, data)
+            except (serial.SerialException, OSError, TypeError, AttributeError, RuntimeError):
+                break # port or event loop got closed
+
+    def _read_and_decode_in_thread(self):
+        # io_thread mode: the frames are decoded right where they are read and stamped with their arrival time
+        ser = self.ser
+        received_frames = self._received_frames
+        while ser.is_open:
+            try:
+                data = ser.read(max(1, ser.in_waiting))
+                if not data:
+                    continue
+                arrival_time = time.perf_counter()
+                if self._traffic_recorder is not None:
+                    self._traffic_recorder.record(DIRECTION_RECEIVED, data)
+                self.frame_decoder.feed(data, lambda frame: received_frames.append((arrival_time, bytes(frame))))
+                if received_frames and not self._is_frame_handoff_scheduled:
+                    # one wakeup of the event loop per batch, however many frames are queued until it runs
+                    self._is_frame_handoff_scheduled = True
+                    self._loop.call_soon_threadsafe(self._process_received_frames)
+            except (serial.SerialException, OSError, TypeError, AttributeError, RuntimeError):
+                break # port or event loop got closed
+
+    def _process_received_frames(self):
+        # reset before draining: a frame appended meanwhile either is drained here or schedules the next call
+        self._is_frame_handoff_scheduled = False
+        received_frames = self._received_frames
+        while received_frames:
+            arrival_time, frame = received_frames.popleft()
+            self._process_frame(frame, arrival_time)
+
     def _validate_data(self, data, command_type, expected_function_sub_nr):
         if data is None or len(data) < 13:
             raise DataLengthError(f"Error: Did not receive enough data. only got: {len(data)} >> {data}")
@@ -148,9 +415,9 @@ class DeviceController:
         if start_byte != 0xAA:
             raise StartByteError(f"Error: Start byte is wrong - device is not compatible. >> {data}")
         
-        command_type = extract_number(data, 1, 2)
-        if command_type != command_type:
-            raise FunctionNumberError(f"Error: {command_type.__name__} is not what was expected. >> {data}")
+        function_nr = extract_number(data, 1, 2)
+        if function_nr != command_type:
+            raise FunctionNumberError(f"Error: function number {function_nr} is not what was expected. >> {data}")
         
         function_sub_nr = extract_number(data, 2, 3)
         if function_sub_nr != expected_function_sub_nr:
@@ -160,63 +427,143 @@ class DeviceController:
         return True
     
     def send_data(self, data):
+        if self._traffic_recorder is not None:
+            self._traffic_recorder.record(DIRECTION_SENT, data)
         self.ser.write(data)  # Send data
 
-    def _apply_strategy(self, data):
-        function_nr = extract_number(data, 1, 2)
-        function_sub_id = extract_number(data, 2, 3)
-
-        # search for the proper startegy for that data
-        for strategy in self._data_processing_strategies:
-            if strategy.applies_to(function_nr, function_sub_id):
-                strategy.process_data(self, data)
+    def _resolve_response_waiter(self, function_nr, function_sub_nr, frame_time, result=None):
+        # the oldest request that expects this frame gets it, together with the time the frame arrived or the given result
+        for waiter in self._response_waiters:
+            expected_function_nr, expected_function_sub_nr, future, command, send_time = waiter
+            if expected_function_nr == function_nr and expected_function_sub_nr in (None, function_sub_nr):
+                self._response_waiters.remove(waiter)
+                if not future.done():
+                    future.set_result(frame_time if result is None else result)
+                if self.metrics is not None and command is not None:
+                    self.metrics.record_latency(command, (frame_time - send_time) * 1000)
                 return True
-        return False  # no matching strategy was found
+        return False
+
+    def _add_response_waiter(self, function_nr, function_sub_nr=None, command=None):
+        try:
+            future = asyncio.get_running_loop().create_future()
+        except RuntimeError:
+            return None # called outside of an event loop, nobody could await the response anyway
+        self._response_waiters.append([function_nr, function_sub_nr, future, command, time.perf_counter()])
+        return future
+
+    def _discard_response_waiter(self, future):
+        self._response_waiters = [waiter for waiter in self._response_waiters if waiter[2] is not future]
+
+    async def _wait_for_response_async(self, function_nr, timeout) -> bool:
+        if not self._is_reader_running() and self.ser is not None:
+            self._start_reader()
+        # wait for the oldest outstanding request of that type or, if nothing was requested, for the next frame of that type
+        future = next((waiter[2] for waiter in self._response_waiters if waiter[0] == function_nr), None)
+        if future is None:
+            future = self._add_response_waiter(function_nr)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            # give up on this request so that a lost response does not shift all following responses
+            self._discard_response_waiter(future)
+            if self.metrics is not None:
+                self.metrics.record_timeout(CommandTypes(function_nr))
+            return False
+        except asyncio.CancelledError:
+            self._discard_response_waiter(future)
+            raise
+
+    def _apply_strategy(self, data):
+        # bytes 1 and 2 of the frame are the function number and the function sub number
+        strategy = self._strategy_dispatch_table.get((data[1], data[2]))
+        if strategy is None:
+            strategy = self._strategy_dispatch_table.get((data[1], None)) # strategies that accept every function sub number
+        if strategy is None:
+            return False  # no matching strategy was found
+        strategy.process_data(self, data)
+        return True
     
     def receive_data(self):
         # Read available data without blocking
         bytes_to_read = self.ser.in_waiting
         if bytes_to_read:
-            data = self.ser.read(bytes_to_read)
-            self._buffer.extend(data)
-
-        # Check if we have enough data to process
-        if len(self._buffer) >= self._expected_length:
-            # Process data here
-            data_to_process = self._buffer[:self._expected_length]
-            if not self._apply_strategy(data_to_process):
-                print("could not find a proper strategy for this data block", data_to_process)
-            # Remove processed data from buffer
-            del self._buffer[:self._expected_length]
+            self._on_data_received(self.ser.read(bytes_to_read))
 
         # Optionally, you can return whether data was processed
         return None
 
+    def _on_data_received(self, data):
+        # process every complete frame, several of them can arrive with one read
+        if self._traffic_recorder is not None:
+            self._traffic_recorder.record(DIRECTION_RECEIVED, data)
+        self.frame_decoder.feed(data, self._process_frame)
+
+    def _process_frame(self, frame, arrival_time=None):
+        # arrival_time: when the io thread read the frame; otherwise it arrived just now
+        if self._apply_strategy(frame):
+            if frame[1] == CommandTypes.POWER_REQUEST.value:
+                if arrival_time is not None:
+                    self.last_sample_time = arrival_time # instead of the time the strategy got to process it
+                frame_time = self.last_sample_time
+                self.acquisition_scheduler.record_update(frame[2], frame_time)
+                if self._history_size:
+                    self.history.append(self.last_sample_time, self.optical_power, self.adc_value, self.frequency, self.power_adjustment_gear,
+                                        self.wavelength, self.battery_level, self.reference_power)
+                if self._sample_broadcaster.subscriptions:
+                    self._sample_broadcaster.publish(Sample(self.last_sample_time, frame[2], self.optical_power, self.adc_value, self.frequency,
+                                                            self.power_adjustment_gear, self.mode, self.wavelength, self.battery_level, self.reference_power))
+            else:
+                frame_time = arrival_time if arrival_time is not None else time.perf_counter()
+            # an eeprom read gets the (function_nr, function return value, value) entry its answer just added to _eeprom_answers
+            result = self._eeprom_answers[-1] if frame[1] == CommandTypes.READ_EEPROM.value else None
+            self._resolve_response_waiter(frame[1], frame[2], frame_time, result)
+        else:
+            if self.metrics is not None:
+                self.metrics.unmatched_frames += 1
+            print("could not find a proper strategy for this data block", bytes(frame))
+
     # one can use the command-enum or its value to send the command.
+    # returns a future that resolves as soon as the response to this very request got decoded.
+    # writes right away, past the command_queue; execute_command_async is the way to go next to the background update
     def send_command(self, command: Commands):
         command_type = extract_number( command.value,1,2)
         if command_type == CommandTypes.POWER_REQUEST.value:
             self._is_power_data_received = False
-        if command_type == CommandTypes.DISPLAY_SETTINGS_CHANGE.value:
+            response_future = self._add_response_waiter(command_type, extract_number(command.value,2,3), command)
+        elif command_type == CommandTypes.DISPLAY_SETTINGS_CHANGE.value:
             self._is_display_settings_changed = False
+            self.acquisition_scheduler.mark_stale() # wavelength, unit or reference power may change with it
+            response_future = self._add_response_waiter(command_type, command=command)
+        elif command_type in (CommandTypes.READ_EEPROM.value, CommandTypes.STORED_RECORD_COUNT.value):
+            response_future = self._add_response_waiter(command_type, command=command)
+        else:
+            response_future = None
 
         self.send_data(command.value)
+        return response_future
         
+    # reads byte_count (up to 8) bytes of the eeprom starting at address; returns a future like send_command unless expect_response is False
+    def send_eeprom_read(self, address, byte_count=4, expect_response=True):
+        command = Commands.READ_THE_VALUE_OF_CORRESPONDING_ADDRESS_OF_EEPROM
+        request = bytearray(command.value)
+        request[2:5] = (address & 0xFF, address >> 8 & 0xFF, byte_count) # the protocol does not tell the byte order of the address, little endian like everything else is assumed
+        response_future = self._add_response_waiter(CommandTypes.READ_EEPROM.value, command=command) if expect_response else None
+        self.send_data(bytes(request))
+        return response_future
+
     async def wait_for_display_settings_change_async(self, timeout=2) -> bool:
         """
         Waits until `self.display_settings_changed` becomes True or the timeout expires.
 
         :param timeout: Maximum time to wait in seconds.
         """
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            self.receive_data()
-            if self._is_display_settings_changed:
-                self._is_display_settings_changed = False
-                return True
-            await asyncio.sleep(0.01)  # Sleep for 10 milliseconds before checking again
-        else:
-            return False
+        if not self._is_display_settings_changed:
+            if not await self._wait_for_response_async(CommandTypes.DISPLAY_SETTINGS_CHANGE.value, timeout):
+                return False
+        self._is_display_settings_changed = False
+        return True
     
     async def wait_for_power_data_change_async(self, timeout=2) -> bool:
         """
@@ -224,15 +571,11 @@ class DeviceController:
 
         :param timeout: Maximum time to wait in seconds.
         """
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            self.receive_data()
-            if self._is_power_data_received:
-                self._is_power_data_received = False
-                return True
-            await asyncio.sleep(0.01)  # Sleep for 10 milliseconds before checking again
-        else:
-            return False
+        if not self._is_power_data_received:
+            if not await self._wait_for_response_async(CommandTypes.POWER_REQUEST.value, timeout):
+                return False
+        self._is_power_data_received = False
+        return True
         
 class DataValidationError(Exception):
     pass
@@ -0,0 +1,146 @@
+import asyncio
+import struct
+from collections import deque, namedtuple
+
+from commands import Commands, CommandTypes
+
+STORED_RECORD_SIZE = 4 # every stored power record is one little endian float (μW), like the optical power of a live power frame
+MAX_EEPROM_READ_SIZE = 8 # bytes 5 to 12 of the response
+
+
+# one stored power record. value holds the raw bytes in case the record layout of a firmware differs
+class StoredRecord(namedtuple("StoredRecord", ("index", "address", "function_return_value", "value"))):
+    __slots__ = ()
+
+    @property
+    def optical_power(self):
+        return struct.unpack_from("<f", self.value)[0] if len(self.value) >= 4 else None
+
+
+class EepromReadError(Exception):
+    pass
+
+
+# downloads the stored power records of a meter, see DeviceController.download_stored_records().
+# the record count is read first, then the records are read in batches of `window` address reads, each followed by a
+# record count request as marker. the answers carry no address and all markers look the same, so only one marker is
+# in flight at a time: the reads of the next batch are sent right after a marker, its own marker only once that one
+# got answered. a marker answer thus always belongs to the oldest batch, which only counts if exactly its reads were
+# answered before it, and the line is never idle. if an answer got lost, everything in flight is read again one by one
+# (stop and wait, which can not mix up answers) with up to `retries` retries each
+class StoredRecordDownload:
+    def __init__(self, controller, window=8, retries=3, timeout=1.0, record_size=STORED_RECORD_SIZE, first_address=0, settle_time=0.05):
+        if not 0 < record_size <= MAX_EEPROM_READ_SIZE:
+            raise ValueError(f"record_size must be between 1 and {MAX_EEPROM_READ_SIZE} bytes, not {record_size}")
+        self.window = window # reads per batch
+        self.retries = retries
+        self.timeout = timeout # seconds per expected answer
+        self.record_size = record_size
+        self.first_address = first_address
+        self.settle_time = settle_time # seconds without answers after which no late answer is expected anymore
+        self.record_count = None
+        self.records_read = 0
+        self.reads_sent = 0
+        self.reads_repeated = 0
+        self._controller = controller
+
+    def __aiter__(self):
+        return self._read_records_async()
+
+    async def read_all_async(self):
+        return [record async for record in self]
+
+    async def _read_records_async(self):
+        controller = self._controller
+        self.record_count = await controller.read_stored_record_count_async(self.timeout, self.retries)
+        if self.record_count is None:
+            raise EepromReadError("the meter did not answer the request for the number of stored records")
+        controller._eeprom_answers.clear()
+        batches = deque() # [first index, end index, marker future or None while its marker is not sent] in the order the answers are expected
+        next_index = 0
+        while batches or next_index < self.record_count:
+            if not batches:
+                next_index = self._send_batch_reads(batches, next_index)
+            if batches[0][2] is None:
+                batches[0][2] = self._send_marker()
+                if next_index < self.record_count: # keeps the line busy while the marker is on its way
+                    next_index = self._send_batch_reads(batches, next_index)
+            first_index, end_index, marker_future = batches[0]
+            try:
+                await asyncio.wait_for(asyncio.shield(marker_future), self.timeout * (end_index - first_index + 1))
+                values = self._take_answers_until_marker()
+            except asyncio.TimeoutError:
+                values = None
+            if values is not None and len(values) == end_index - first_index:
+                batches.popleft()
+                for index, (function_return_value, value) in enumerate(values, first_index):
+                    yield self._record(index, function_return_value, value)
+                continue
+            unconfirmed = [index for first_index, end_index, _ in batches for index in range(first_index, end_index)]
+            await self._abandon_async([marker_future for _, _, marker_future in batches if marker_future is not None])
+            batches.clear()
+            for index in unconfirmed:
+                yield await self._read_record_with_retries_async(index)
+
+    def _address(self, index):
+        return self.first_address + index * self.record_size
+
+    def _send_batch_reads(self, batches, first_index):
+        # sends the reads of the next batch without its marker, returns the index after it
+        controller = self._controller
+        end_index = min(first_index + self.window, self.record_count)
+        for index in range(first_index, end_index):
+            controller.send_eeprom_read(self._address(index), self.record_size, expect_response=False)
+        self.reads_sent += end_index - first_index
+        batches.append([first_index, end_index, None])
+        return end_index
+
+    def _send_marker(self):
+        return self._controller.send_command(Commands.RETURNS_THE_NUMBER_OF_STORED_POWER_RECORDS)
+
+    def _take_answers_until_marker(self):
+        # the (function return value, value) of the reads answered before the next marker, None if the marker is missing
+        answers = self._controller._eeprom_answers
+        values = []
+        while answers:
+            function_nr, function_return_value, value = answers.popleft()
+            if function_nr == CommandTypes.STORED_RECORD_COUNT.value:
+                return values
+            values.append((function_return_value, value))
+        return None
+
+    def _record(self, index, function_return_value, value):
+        self.records_read += 1
+        return StoredRecord(index, self._address(index), function_return_value, value[:self.record_size])
+
+    async def _abandon_async(self, futures):
+        controller = self._controller
+        for future in futures:
+            controller._discard_response_waiter(future)
+        if controller.metrics is not None:
+            controller.metrics.record_timeout(CommandTypes.READ_EEPROM)
+        # the abandoned requests may still be answered: wait until no answer came in for settle_time
+        answers = controller._eeprom_answers
+        while True:
+            answers.clear()
+            await asyncio.sleep(self.settle_time)
+            if not answers:
+                return
+
+    async def _read_record_with_retries_async(self, index):
+        controller = self._controller
+        for attempt in range(self.retries + 1):
+            if attempt and controller.metrics is not None:
+                controller.metrics.record_retry(Commands.READ_THE_VALUE_OF_CORRESPONDING_ADDRESS_OF_EEPROM)
+            self.reads_sent += 1
+            self.reads_repeated += 1
+            future = controller.send_eeprom_read(self._address(index), self.record_size)
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.timeout)
+                if len(controller._eeprom_answers) == 1: # anything else means a late answer got in between
+                    _, function_return_value, value = controller._eeprom_answers.popleft()
+                    return self._record(index, function_return_value, value)
+            except asyncio.TimeoutError:
+                pass
+            await self._abandon_async([future])
+        raise EepromReadError(f"the meter did not answer the read of record {index} at address {self._address(index)} after {self.retries} retries")
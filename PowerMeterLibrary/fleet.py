@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+from device_controller import DeviceController
+
+
+# the values of all meters of a fleet at one point in time
+class FleetSnapshot:
+    def __init__(self, snapshot_time, readings):
+        self.time = snapshot_time # time.perf_counter() the snapshot was taken at
+        self.readings = readings # port -> dict of the meter's latest values, None for meters that have not answered yet
+
+    def __repr__(self):
+        return f"FleetSnapshot(time={self.time:.6f}, readings={self.readings})"
+
+
+# holds many power meters on one host and polls all of them concurrently.
+# every meter has its own request/response cycle, so a slow or unplugged meter only delays its own samples
+class PowerMeterFleet:
+    def __init__(self, ports=None, connectionTimeout=60, backlight_enabled=False, request_timeout=2, metrics=False):
+        self.controllers = {} # port -> DeviceController
+        self.sample_counts = {} # port -> number of received power samples
+        self.timeout_counts = {} # port -> number of unanswered requests
+        self.connection_errors = {} # port -> why the meter could not be connected (it is left out of the fleet) or why its port failed later on
+        self._ports = ports # port names, pyserial urls or opened ports; None searches all serial ports for meters
+        self._connection_timeout = connectionTimeout
+        self._backlight_enabled = backlight_enabled
+        self._request_timeout = request_timeout
+        self._metrics = metrics # DeviceController(metrics=...) of every meter, e.g. for metrics.MetricsExporter(fleet.controllers)
+        self._poll_tasks = []
+        self._stop_event = asyncio.Event()
+
+    async def __aenter__(self):
+        await self.connect_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            await self.stop_update_async()
+        finally:
+            # one meter that fails to close must not keep the others open
+            await asyncio.gather(*(controller.__aexit__(exc_type, exc_val, exc_tb) for controller in self.controllers.values()),
+                                 return_exceptions=True)
+        return False
+
+    async def discover_ports_async(self):
+        # every serial port that answers like a power meter
+        prober = DeviceController(port_cache_file=None)
+        return await prober._probe_ports_async([port.device for port in prober._list_candidate_ports()], first_only=False)
+
+    async def connect_async(self):
+        ports = self._ports if self._ports is not None else await self.discover_ports_async()
+        for index, port in enumerate(ports):
+            controller = DeviceController(self._connection_timeout, self._backlight_enabled, port=port, port_cache_file=None, metrics=self._metrics)
+            name = port if isinstance(port, str) else port.port
+            self.controllers[name if name not in self.controllers else f"{name}#{index}"] = controller
+        try:
+            results = await asyncio.gather(*(controller.__aenter__() for controller in self.controllers.values()), return_exceptions=True)
+        except BaseException: # cancelled: none of the ports may stay open
+            for controller in self.controllers.values():
+                controller._close_serial_port()
+            raise
+        for (port, controller), result in zip(list(self.controllers.items()), results):
+            if isinstance(result, BaseException) or controller.ser is None:
+                self.connection_errors[port] = result if isinstance(result, BaseException) else TimeoutError("no meter found")
+                print(f"could not connect to the meter on port {port}: {self.connection_errors[port]}")
+                controller._close_serial_port()
+                del self.controllers[port]
+        if not self.controllers and self.connection_errors:
+            raise ConnectionError(f"none of the meters could be connected: {self.connection_errors}")
+        for port in self.controllers:
+            self.sample_counts[port] = 0
+            self.timeout_counts[port] = 0
+
+    def start_update_in_background(self):
+        if not self._poll_tasks:
+            self._stop_event.clear()
+            self._poll_tasks = [asyncio.create_task(self._poll_meter_async(port, controller)) for port, controller in self.controllers.items()]
+
+    async def stop_update_async(self):
+        self._stop_event.set()
+        if self._poll_tasks:
+            await asyncio.gather(*self._poll_tasks, return_exceptions=True)
+            self._poll_tasks = []
+
+    async def _poll_meter_async(self, port, controller):
+        while not self._stop_event.is_set():
+            try:
+                is_received = await controller.update_async(self._request_timeout)
+            except Exception as error: # e.g. the meter got unplugged: only this meter stops, the others keep polling
+                self._record_port_error(port, error)
+                return
+            if is_received:
+                self.sample_counts[port] += 1
+            else:
+                self.timeout_counts[port] += 1
+            await asyncio.sleep(0)
+
+    def _record_port_error(self, port, error):
+        self.connection_errors[port] = error
+        print(f"the meter on port {port} failed: {error!r}")
+
+    def snapshot(self) -> FleetSnapshot:
+        # the latest values of every meter; 'age' tells how old each of them is at the snapshot time
+        now = time.perf_counter()
+        readings = {}
+        for port, controller in self.controllers.items():
+            if controller.last_sample_time is None:
+                readings[port] = None
+                continue
+            readings[port] = {
+                "optical_power": controller.optical_power,
+                "wavelength": controller.wavelength,
+                "battery_level": controller.battery_level,
+                "adc_value": controller.adc_value,
+                "reference_power": controller.reference_power,
+                "sample_time": controller.last_sample_time,
+                "age": now - controller.last_sample_time,
+            }
+        return FleetSnapshot(now, readings)
+
+    async def acquire_snapshot_async(self, timeout=None) -> FleetSnapshot:
+        # requests a new sample from all meters at the same time and waits for all of them (or the timeout).
+        # meant for use without background polling, which would interleave its own requests
+        results = await asyncio.gather(*(controller.update_async(timeout or self._request_timeout) for controller in self.controllers.values()),
+                                       return_exceptions=True)
+        for port, is_received in zip(self.controllers, results):
+            if isinstance(is_received, BaseException): # a broken meter keeps its last values, the others are still updated
+                self._record_port_error(port, is_received)
+            elif is_received:
+                self.sample_counts[port] += 1
+            else:
+                self.timeout_counts[port] += 1
+        return self.snapshot()
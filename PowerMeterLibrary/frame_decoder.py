@@ -0,0 +1,64 @@
+from commands import Commands, CommandTypes
+
+FRAME_LENGTH = 13
+START_BYTE = 0xAA
+KNOWN_FUNCTION_NUMBERS = frozenset(command.value[1] for command in Commands)
+# function numbers whose response sub numbers are known; a frame with another sub number is not in sync
+KNOWN_FUNCTION_SUB_NUMBERS = {
+    CommandTypes.POWER_REQUEST.value: frozenset((0x00, 0x01, 0x80)),
+}
+
+
+# splits the byte stream of the serial port into 13 byte frames.
+# it looks for the 0xAA start byte followed by a known function number, so a stray or lost byte only costs the
+# frame it hit instead of shifting every following frame, and it hands out all complete frames of a read at once.
+class FrameDecoder:
+    def __init__(self):
+        self.frames_decoded = 0
+        self.discarded_bytes = 0 # bytes that did not belong to any valid frame
+        self.resyncs = 0 # how often the decoder had to search for the next start byte
+        self._buffer = bytearray()
+
+    @property
+    def buffered_bytes(self):
+        return len(self._buffer)
+
+    def feed(self, data, on_frame):
+        # calls on_frame(frame) for every complete frame. frame is a memoryview into the receive buffer that is
+        # only valid during the call - copy it (bytes(frame)) to keep it
+        buffer = self._buffer
+        buffer += data
+        end = len(buffer)
+        offset = 0
+        with memoryview(buffer) as view:
+            while end - offset >= FRAME_LENGTH:
+                if not self._is_frame_start(buffer, offset):
+                    next_start = buffer.find(START_BYTE, offset + 1)
+                    if next_start < 0:
+                        next_start = end
+                    self.discarded_bytes += next_start - offset
+                    self.resyncs += 1
+                    offset = next_start
+                    continue
+                frame = view[offset:offset + FRAME_LENGTH]
+                offset += FRAME_LENGTH
+                self.frames_decoded += 1
+                on_frame(frame)
+                frame.release()
+        if offset:
+            try:
+                del buffer[:offset]
+            except BufferError:
+                self._buffer = buffer[offset:] # on_frame kept a view into the buffer, leave that one alone
+
+    def reset(self):
+        self._buffer = bytearray()
+
+    def _is_frame_start(self, buffer, offset):
+        if buffer[offset] != START_BYTE:
+            return False
+        function_nr = buffer[offset + 1]
+        if function_nr not in KNOWN_FUNCTION_NUMBERS:
+            return False
+        function_sub_numbers = KNOWN_FUNCTION_SUB_NUMBERS.get(function_nr)
+        return function_sub_numbers is None or buffer[offset + 2] in function_sub_numbers
@@ -0,0 +1,188 @@
+import asyncio
+import bisect
+
+# upper bounds of the latency histogram buckets in ms, a 9600 baud round trip alone takes about 27 ms
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+METRICS_PREFIX = "powermeter"
+
+
+# counts the round trips of one command per bucket; observing only costs a bisect and three additions
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one counts everything above the largest bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, milliseconds):
+        self.counts[bisect.bisect_left(self.buckets, milliseconds)] += 1
+        self.count += 1
+        self.sum += milliseconds
+
+    def percentile(self, fraction):
+        # upper bound of the bucket the percentile falls into, None without observations
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+# the metrics of one controller, see DeviceController(metrics=True). the controller only updates them behind an
+# 'if self.metrics is not None', and everything it already counts anyway (decoded frames, discarded bytes, buffers)
+# is read when a snapshot is taken instead of being counted twice
+class ControllerMetrics:
+    def __init__(self, controller):
+        self.latencies = {} # command name -> LatencyHistogram of its request round trips
+        self.timeouts = {} # function type name -> requests that were not answered in time
+        self.retries = {} # command name -> requests sent again after a timeout
+        self.unmatched_frames = 0 # frames without a matching strategy
+        self._controller = controller
+
+    def record_latency(self, command, milliseconds):
+        histogram = self.latencies.get(command.name)
+        if histogram is None:
+            histogram = self.latencies[command.name] = LatencyHistogram()
+        histogram.observe(milliseconds)
+
+    def record_timeout(self, command_type):
+        self.timeouts[command_type.name] = self.timeouts.get(command_type.name, 0) + 1
+
+    def record_retry(self, command):
+        self.retries[command.name] = self.retries.get(command.name, 0) + 1
+
+    def snapshot(self):
+        # plain numbers only, cheap enough to call for every GUI refresh
+        controller = self._controller
+        decoder = controller.frame_decoder
+        subscriptions = controller._sample_broadcaster.subscriptions
+        return {
+            "frames_decoded": decoder.frames_decoded,
+            "discarded_bytes": decoder.discarded_bytes,
+            "resyncs": decoder.resyncs,
+            "unmatched_frames": self.unmatched_frames,
+            "timeouts": dict(self.timeouts),
+            "retries": dict(self.retries),
+            "latency_ms": {command: {"count": histogram.count,
+                                     "mean": histogram.sum / histogram.count if histogram.count else None,
+                                     "p50": histogram.percentile(0.5),
+                                     "p99": histogram.percentile(0.99)}
+                           for command, histogram in self.latencies.items()},
+            "decoder_buffered_bytes": decoder.buffered_bytes,
+            "pending_responses": len(controller._response_waiters),
+            "io_thread_queued_frames": len(controller._received_frames),
+            "stream_subscriptions": len(subscriptions),
+            "stream_max_queued_samples": max((len(subscription) for subscription in subscriptions), default=0),
+            "history_samples": len(controller._history) if controller._history is not None else 0, # without creating it
+        }
+
+    def prometheus_text(self, labels=""):
+        # the metrics in the Prometheus text exposition format; labels e.g. 'meter="COM3"'
+        return prometheus_text({labels: self})
+
+
+COUNTERS = (
+    ("frames_decoded", "Frames decoded from the serial port."),
+    ("discarded_bytes", "Received bytes that did not belong to a valid frame."),
+    ("resyncs", "Searches for the next frame start."),
+    ("unmatched_frames", "Frames without a matching strategy."),
+)
+GAUGES = (
+    ("decoder_buffered_bytes", "Bytes of an incomplete frame in the decoder."),
+    ("pending_responses", "Requests waiting for their response."),
+    ("io_thread_queued_frames", "Frames decoded by the io thread that the event loop did not process yet."),
+    ("stream_max_queued_samples", "Samples queued for the slowest stream subscriber."),
+    ("history_samples", "Samples in the history ring buffer."),
+)
+
+
+def prometheus_text(metrics_by_labels):
+    # one text for several controllers, {'meter="COM3"': controller.metrics, ...}; every metric family is listed once
+    snapshots = {labels: metrics.snapshot() for labels, metrics in metrics_by_labels.items()}
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+
+    def sample(name, labels, value, extra_labels=""):
+        all_labels = ",".join(label for label in (labels, extra_labels) if label)
+        lines.append(f"{METRICS_PREFIX}_{name}{{{all_labels}}} {value}" if all_labels else f"{METRICS_PREFIX}_{name} {value}")
+
+    for name, help_text in COUNTERS:
+        family(f"{name}_total", "counter", help_text)
+        for labels, snapshot in snapshots.items():
+            sample(f"{name}_total", labels, snapshot[name])
+    family("timeouts_total", "counter", "Requests that were not answered in time.")
+    for labels, snapshot in snapshots.items():
+        for function, count in snapshot["timeouts"].items():
+            sample("timeouts_total", labels, count, f'function="{function}"')
+    family("retries_total", "counter", "Requests sent again after a timeout.")
+    for labels, snapshot in snapshots.items():
+        for command, count in snapshot["retries"].items():
+            sample("retries_total", labels, count, f'command="{command}"')
+    for name, help_text in GAUGES:
+        family(name, "gauge", help_text)
+        for labels, snapshot in snapshots.items():
+            sample(name, labels, snapshot[name])
+    family("request_latency_milliseconds", "histogram", "Round trip of the requests per command.")
+    for labels, metrics in metrics_by_labels.items():
+        for command, histogram in metrics.latencies.items():
+            command_label = f'command="{command}"'
+            bounds = [str(bound) for bound in histogram.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, histogram.cumulative_counts()):
+                sample("request_latency_milliseconds_bucket", labels, count, f'{command_label},le="{bound}"')
+            sample("request_latency_milliseconds_sum", labels, histogram.sum, command_label)
+            sample("request_latency_milliseconds_count", labels, histogram.count, command_label)
+    return "\n".join(lines) + "\n"
+
+
+# serves the Prometheus text of one or more controllers on http://host:port/metrics.
+# binds to localhost by default, the metrics are not meant to leave the measurement host unless asked for
+class MetricsExporter:
+    def __init__(self, controllers, host="127.0.0.1", port=9464):
+        self.controllers = controllers # {label value: controller}, e.g. fleet.controllers
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start_async(self):
+        self._server = await asyncio.start_server(self._handle_request_async, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1] # port 0 picks a free one
+
+    async def stop_async(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def render(self):
+        return prometheus_text({f'meter="{name}"': controller.metrics
+                                for name, controller in self.controllers.items() if controller.metrics is not None})
+
+    async def _handle_request_async(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip(): # skip the headers
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
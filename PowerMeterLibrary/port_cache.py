@@ -0,0 +1,53 @@
+import json
+import os
+
+DEFAULT_PORT_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".powermeterlibrary", "port_cache.json")
+
+
+# remembers the last port a power meter answered on, together with the USB ids of its adapter,
+# so that the next connect can try that port first instead of probing every serial port
+class PortCache:
+    def __init__(self, path=DEFAULT_PORT_CACHE_FILE):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if isinstance(entry, dict) and entry.get("device") else None
+
+    def store(self, port_info):
+        # port_info is a serial.tools.list_ports ListPortInfo or a plain port name
+        entry = {
+            "device": getattr(port_info, "device", port_info),
+            "vid": getattr(port_info, "vid", None),
+            "pid": getattr(port_info, "pid", None),
+            "serial_number": getattr(port_info, "serial_number", None),
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(temp_path, self.path) # never leave a half written cache behind
+        except OSError as e:
+            print(f"could not store the port cache {self.path}: {e}")
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def find_cached_port(self, available_ports):
+        # the adapter can show up under another name after replugging, so its USB ids win over the stored name
+        entry = self.load()
+        if entry is None:
+            return None
+        if entry.get("vid") is not None:
+            for port in available_ports:
+                if (port.vid, port.pid, port.serial_number) == (entry["vid"], entry["pid"], entry["serial_number"]):
+                    return port.device
+        return entry["device"]
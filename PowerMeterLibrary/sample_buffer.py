@@ -0,0 +1,120 @@
+import math
+
+import numpy as np
+
+# one row per received power frame; values the frame did not carry hold the last known value, NaN if there was none yet
+SAMPLE_DTYPE = np.dtype([
+    ("time", "f8"), # time.perf_counter() of the frame
+    ("optical_power", "f4"), # μW
+    ("adc_value", "f4"),
+    ("frequency", "f4"),
+    ("power_adjustment_gear", "f4"),
+    ("wavelength", "f4"), # nm
+    ("battery_level", "f4"), # %
+    ("reference_power", "f4"), # μW
+])
+
+
+def microwatt_to_dbm(microwatt):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 10.0 * np.log10(np.asarray(microwatt, dtype="f8") / 1000.0)
+
+
+def dbm_to_microwatt(dbm):
+    return 1000.0 * np.power(10.0, np.asarray(dbm, dtype="f8") / 10.0)
+
+
+# a fixed size history of the acquired samples. the array is allocated once, appending only writes one row,
+# so memory stays constant on long runs. the queries work on the last N samples or the last T seconds
+class SampleRingBuffer:
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self._data = np.empty(capacity, dtype=SAMPLE_DTYPE) # rows beyond len(self) are never read, so they need no initialization
+        self._next_index = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, time, optical_power, adc_value=None, frequency=None, power_adjustment_gear=None,
+               wavelength=None, battery_level=None, reference_power=None):
+        nan = math.nan
+        self._data[self._next_index] = (
+            time,
+            nan if optical_power is None else optical_power,
+            nan if adc_value is None else adc_value,
+            nan if frequency is None else frequency,
+            nan if power_adjustment_gear is None else power_adjustment_gear,
+            nan if wavelength is None else wavelength,
+            nan if battery_level is None else battery_level,
+            nan if reference_power is None else reference_power,
+        )
+        self._next_index += 1
+        if self._next_index == self.capacity:
+            self._next_index = 0
+        if self._count < self.capacity:
+            self._count += 1
+
+    def clear(self):
+        self._next_index = 0
+        self._count = 0
+
+    def window(self, last_n=None, seconds=None):
+        # the selected samples in chronological order. a view while the buffer has not wrapped, a copy otherwise
+        if self._count < self.capacity:
+            samples = self._data[:self._count]
+        elif self._next_index == 0:
+            samples = self._data
+        else:
+            samples = np.concatenate((self._data[self._next_index:], self._data[:self._next_index]))
+        if last_n is not None:
+            samples = samples[max(0, len(samples) - last_n):]
+        if seconds is not None and len(samples):
+            times = samples["time"]
+            samples = samples[np.searchsorted(times, times[-1] - seconds, side="left"):]
+        return samples
+
+    def column(self, field="optical_power", last_n=None, seconds=None):
+        return self.window(last_n, seconds)[field]
+
+    def mean(self, field="optical_power", last_n=None, seconds=None):
+        return self._reduce(np.nanmean, field, last_n, seconds)
+
+    def std(self, field="optical_power", last_n=None, seconds=None):
+        return self._reduce(np.nanstd, field, last_n, seconds)
+
+    def min(self, field="optical_power", last_n=None, seconds=None):
+        return self._reduce(np.nanmin, field, last_n, seconds)
+
+    def max(self, field="optical_power", last_n=None, seconds=None):
+        return self._reduce(np.nanmax, field, last_n, seconds)
+
+    def percentile(self, q, field="optical_power", last_n=None, seconds=None):
+        # q may be a single percentile or a list of them, e.g. [1, 50, 99]
+        return self._reduce(lambda values: np.nanpercentile(values, q), field, last_n, seconds)
+
+    def statistics(self, field="optical_power", last_n=None, seconds=None, dbm=False):
+        # everything a stability check needs in one pass over the window; dbm converts μW values first
+        values = self.column(field, last_n, seconds).astype("f8")
+        if dbm:
+            values = microwatt_to_dbm(values)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return None
+        p1, p50, p99 = np.percentile(values, [1, 50, 99])
+        return {
+            "count": len(values),
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "p1": float(p1),
+            "p50": float(p50),
+            "p99": float(p99),
+        }
+
+    def _reduce(self, function, field, last_n, seconds):
+        values = self.column(field, last_n, seconds).astype("f8")
+        if not len(values) or np.isnan(values).all():
+            return None
+        return function(values)
@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+import math
+import os
+import struct
+import time
+
+import numpy as np
+
+# a sample log is a 64 byte header followed by fixed size little endian records, appended batch by batch.
+# a crash can at most tear the last record, which the reader ignores
+LOG_MAGIC = b"PMSAMPLE"
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct("<8sHHHxxd40x") # magic, version, header size, record size, creation time (unix)
+LOG_RECORD_DTYPE = np.dtype([
+    ("time", "<f8"), # unix time of the sample
+    ("function_sub_nr", "u1"),
+    ("optical_power", "<f4"), # μW
+    ("adc_value", "<f4"),
+    ("frequency", "<f4"),
+    ("power_adjustment_gear", "<f4"),
+    ("mode", "<f4"),
+    ("wavelength", "<f4"), # nm
+    ("battery_level", "<f4"), # %
+    ("reference_power", "<f4"), # μW
+])
+LOG_FILE_EXTENSION = ".pmlog"
+
+
+# writes the samples of a controller into sample log files. the samples are collected from a stream() subscription
+# and written in batches by a worker thread, so the event loop only pays for queueing them
+class SampleLogWriter:
+    def __init__(self, directory, prefix="samples", batch_size=1000, flush_interval=1.0, rotate_bytes=None, rotate_seconds=None,
+                 fsync=False, queue_size=100000):
+        self.directory = directory
+        self.prefix = prefix
+        self.batch_size = batch_size # samples per write
+        self.flush_interval = flush_interval # seconds after which a partial batch is written anyway
+        self.rotate_bytes = rotate_bytes # start a new file when the current one reaches this size
+        self.rotate_seconds = rotate_seconds # or when it is this old
+        self.fsync = fsync # make every batch durable before the next one is written
+        self.samples_written = 0
+        self.files = [] # paths of all files written so far
+        self._queue_size = queue_size
+        self._subscription = None
+        self._task = None
+        self._file = None
+        self._file_created = None
+        # sample times are time.perf_counter() values, the log stores unix times
+        self._clock_offset = time.time() - time.perf_counter()
+
+    @property
+    def dropped(self):
+        # samples lost because writing could not keep up
+        return self._subscription.dropped if self._subscription else 0
+
+    def start(self, controller):
+        self._subscription = controller.stream(self._queue_size, "drop_oldest")
+        self._task = asyncio.create_task(self._write_batches_async())
+
+    async def stop_async(self):
+        if self._subscription is not None:
+            self._subscription.close() # the writer task writes what is left and ends
+        if self._task is not None:
+            await self._task
+            self._task = None
+        self._close_file()
+
+    async def _write_batches_async(self):
+        while True:
+            batch = await self._subscription.get_batch_async(self.batch_size, self.flush_interval)
+            if batch:
+                await asyncio.to_thread(self.write_samples, batch)
+            elif self._subscription.closed and not len(self._subscription):
+                return
+
+    def write_samples(self, samples):
+        # converts and appends a batch of Sample records; runs in the worker thread
+        records = np.empty(len(samples), dtype=LOG_RECORD_DTYPE)
+        nan = math.nan
+        offset = self._clock_offset
+        records[:] = [(sample.time + offset, sample.function_sub_nr,
+                       *(nan if value is None else value for value in sample[2:]))
+                      for sample in samples]
+        file = self._current_file()
+        file.write(records.tobytes())
+        file.flush()
+        if self.fsync:
+            os.fsync(file.fileno())
+        self.samples_written += len(samples)
+
+    def _current_file(self):
+        if self._file is not None:
+            too_big = self.rotate_bytes is not None and self._file.tell() >= self.rotate_bytes
+            too_old = self.rotate_seconds is not None and time.time() - self._file_created >= self.rotate_seconds
+            if too_big or too_old:
+                self._close_file()
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._file_created = time.time()
+            timestamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(self._file_created))
+            # several writers may share the directory, e.g. the meters of a fleet: the pid and a counter keep their
+            # names apart and 'x' makes sure no file is ever appended to by two of them
+            for attempt in itertools.count():
+                name = f"{self.prefix}_{timestamp}_{os.getpid()}_{len(self.files):04d}{f'_{attempt}' if attempt else ''}{LOG_FILE_EXTENSION}"
+                path = os.path.join(self.directory, name)
+                try:
+                    self._file = open(path, "xb")
+                    break
+                except FileExistsError:
+                    pass
+            self._file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, LOG_HEADER.size, LOG_RECORD_DTYPE.itemsize, self._file_created))
+            self._file.flush()
+            self.files.append(path)
+        return self._file
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# memory maps a sample log; the columns are numpy arrays backed by the file, nothing is parsed up front
+class SampleLogReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(LOG_HEADER.size)
+        if len(header) < LOG_HEADER.size:
+            raise ValueError(f"{path} is not a sample log or its header got never written completely")
+        magic, version, header_size, record_size, self.created = LOG_HEADER.unpack(header)
+        if magic != LOG_MAGIC:
+            raise ValueError(f"{path} is not a sample log")
+        if version != LOG_VERSION or record_size != LOG_RECORD_DTYPE.itemsize:
+            raise ValueError(f"{path} has the unsupported log version {version} with {record_size} byte records")
+        count = (os.path.getsize(path) - header_size) // record_size # a torn last record is left out
+        if count:
+            self.records = np.memmap(path, dtype=LOG_RECORD_DTYPE, mode="r", offset=header_size, shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=LOG_RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, field):
+        return self.records[field]
+
+    @property
+    def columns(self):
+        return {field: self.records[field] for field in LOG_RECORD_DTYPE.names}
+
+    def export_csv(self, csv_path):
+        fmt = ["%.6f", "%d"] + ["%.7g"] * (len(LOG_RECORD_DTYPE.names) - 2)
+        np.savetxt(csv_path, self.records, delimiter=",", fmt=fmt, header=",".join(LOG_RECORD_DTYPE.names), comments="")
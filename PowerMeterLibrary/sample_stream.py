@@ -0,0 +1,149 @@
+import asyncio
+from collections import deque, namedtuple
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+# one received power frame together with the last known additional values of the meter.
+# immutable and without __dict__, so it is cheap to create and can be shared by all subscribers
+class Sample(namedtuple("Sample", ("time", "function_sub_nr", "optical_power", "adc_value", "frequency", "power_adjustment_gear",
+                                   "mode", "wavelength", "battery_level", "reference_power"))):
+    __slots__ = ()
+
+    @property
+    def optical_power_dbm(self):
+        from sample_buffer import microwatt_to_dbm # numpy is only imported once somebody needs it
+        return float(microwatt_to_dbm(self.optical_power)) if self.optical_power is not None else None
+
+
+# the queue of one consumer of controller.stream(). iterate it with 'async for' and close it when done
+class SampleSubscription:
+    def __init__(self, broadcaster, maxsize=1000, overflow="drop_oldest"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, not {overflow!r}")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0 # samples lost because this consumer was too slow
+        self._broadcaster = broadcaster
+        self._queue = deque()
+        self._sample_waiter = None # set while the consumer waits for the next sample
+        self._space_waiter = None # set while the acquisition waits for this consumer ('block' policy)
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._queue:
+            if self._closed:
+                raise StopAsyncIteration
+            self._sample_waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._sample_waiter
+            finally:
+                self._sample_waiter = None
+        sample = self._queue.popleft()
+        if len(self._queue) < self.maxsize:
+            self._wake(self._space_waiter)
+        return sample
+
+    def __len__(self):
+        return len(self._queue)
+
+    async def get_batch_async(self, max_items=1000, timeout=None):
+        # waits up to timeout seconds for the first sample and returns everything queued up to max_items.
+        # an empty list means the timeout expired or the subscription got closed
+        if not self._queue and not self._closed:
+            self._sample_waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._sample_waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._sample_waiter = None
+        queue = self._queue
+        batch = [queue.popleft() for _ in range(min(max_items, len(queue)))]
+        self._wake(self._space_waiter)
+        return batch
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def is_full(self):
+        return len(self._queue) >= self.maxsize
+
+    def close(self):
+        self._closed = True
+        self._broadcaster.unsubscribe(self)
+        self._wake(self._sample_waiter)
+        self._wake(self._space_waiter)
+
+    def publish(self, sample):
+        # called for every sample by the acquisition, never blocks
+        queue = self._queue
+        if len(queue) >= self.maxsize:
+            # 'block' makes the acquisition wait in wait_for_space_async before it requests the next sample, the queue
+            # is only full here for responses that were already on their way, e.g. of pipelined requests. they are dropped
+            if self.overflow != "drop_oldest":
+                self.dropped += 1
+                return
+            queue.popleft()
+            self.dropped += 1
+        queue.append(sample)
+        self._wake(self._sample_waiter)
+
+    async def wait_for_space_async(self, stop_event=None):
+        # also returns as soon as stop_event is set, so a consumer that stopped reading can not keep the acquisition from stopping
+        stop_task = asyncio.create_task(stop_event.wait()) if stop_event is not None else None
+        try:
+            while self.is_full() and not self._closed and not (stop_event is not None and stop_event.is_set()):
+                self._space_waiter = asyncio.get_running_loop().create_future()
+                try:
+                    await asyncio.wait([self._space_waiter] + ([stop_task] if stop_task else []), return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    self._space_waiter = None
+        finally:
+            if stop_task is not None:
+                stop_task.cancel()
+
+    def _wake(self, waiter):
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+
+# hands every sample to all subscriptions. publishing costs nothing while nobody is subscribed
+class SampleBroadcaster:
+    def __init__(self):
+        self.subscriptions = []
+        self._blocking_subscriptions = []
+
+    def subscribe(self, maxsize=1000, overflow="drop_oldest"):
+        subscription = SampleSubscription(self, maxsize, overflow)
+        self.subscriptions.append(subscription)
+        if overflow == "block":
+            self._blocking_subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
+        if subscription in self._blocking_subscriptions:
+            self._blocking_subscriptions.remove(subscription)
+
+    def publish(self, sample):
+        for subscription in self.subscriptions:
+            subscription.publish(sample)
+
+    async def wait_for_capacity_async(self, stop_event=None):
+        # backpressure: only subscriptions with the 'block' policy can hold the acquisition back, until stop_event is set
+        for subscription in list(self._blocking_subscriptions):
+            if subscription.is_full():
+                await subscription.wait_for_space_async(stop_event)
@@ -0,0 +1,236 @@
+import os
+import queue
+import random
+import struct
+import threading
+import time
+
+from serial.urlhandler import protocol_loop
+
+from commands import CommandTypes
+
+FRAME_LENGTH = 13
+START_BYTE = 0xAA
+
+
+# a software FOPM-203/204 that answers the 13 byte protocol of commands.py.
+# it can be reached through a pseudo terminal (open_pty, posix only) or through a pyserial loop:// port (open_serial)
+class SimulatedPowerMeter:
+    def __init__(self, optical_power=1.5, reference_power=1.0, adc_value=512, frequency=0, power_adjustment_gear=1,
+                 mode=0, wavelength_index=4, battery_level=3, noise=0.0,
+                 response_delay=0.0, jitter=0.0, drop_rate=0.0, corrupt_rate=0.0, baudrate=None, seed=None,
+                 power_request_delays=None, stored_records=None):
+        self.optical_power = optical_power
+        self.reference_power = reference_power
+        self.adc_value = adc_value
+        self.frequency = frequency
+        self.power_adjustment_gear = power_adjustment_gear
+        self.mode = mode # 0,1,2,4 = uW, dBm, dB, REF
+        self.wavelength_index = wavelength_index # index into helpers.convert_number_to_wavelength
+        self.battery_level = battery_level # 0..3 bars
+        self.backlight_on = False
+        self.stored_records = list(stored_records or []) # optical powers in μW the meter saved, one 4 byte float each in its eeprom
+        self.noise = noise # standard deviation added to every optical power reading
+        self.response_delay = response_delay # seconds the device needs to answer a request
+        self.power_request_delays = power_request_delays or {} # function sub number -> response delay of that power request instead
+        self.jitter = jitter # uniformly distributed extra delay in seconds
+        self.drop_rate = drop_rate # probability that a request is not answered at all
+        self.corrupt_rate = corrupt_rate # probability that one byte of a response gets flipped
+        self.baudrate = baudrate # if set, the time a frame needs on the wire is simulated in both directions
+        self.requests_received = 0
+        self.responses_sent = 0
+        self.responses_dropped = 0
+        self.responses_corrupted = 0
+        self._random = random.Random(seed)
+        self._input_buffer = bytearray()
+        self._requests = queue.Queue()
+        self._outputs = []
+        self._input_line_free_at = 0.0
+        self._device_free_at = 0.0
+        self._line_free_at = 0.0
+        self._worker = None
+        self._pty_fds = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def open_pty(self):
+        # returns the name of the serial device a DeviceController can connect to
+        import pty
+        import tty
+        master, slave = pty.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        self._pty_fds = (master, slave)
+        self._outputs.append(lambda data: os.write(master, data))
+        threading.Thread(target=self._read_pty, args=(master,), name="SimulatedPowerMeterPty", daemon=True).start()
+        self._start_worker()
+        return os.ttyname(slave)
+
+    def open_serial(self, timeout=1):
+        # returns an open serial port object that can be handed to DeviceController(port=...)
+        ser = SimulatedSerial(self, timeout=timeout)
+        self._outputs.append(ser.deliver)
+        self._start_worker()
+        return ser
+
+    def close(self):
+        self._closed = True
+        self._requests.put(None)
+        if self._pty_fds is not None:
+            for fd in self._pty_fds:
+                os.close(fd)
+            self._pty_fds = None
+
+    def feed(self, data):
+        # bytes written by the host; complete requests are queued for the device
+        written_at = time.perf_counter()
+        self._input_buffer.extend(data)
+        while len(self._input_buffer) >= FRAME_LENGTH:
+            start = self._input_buffer.find(START_BYTE)
+            if start < 0:
+                self._input_buffer.clear()
+                return
+            del self._input_buffer[:start]
+            if len(self._input_buffer) < FRAME_LENGTH:
+                return
+            request = bytes(self._input_buffer[:FRAME_LENGTH])
+            del self._input_buffer[:FRAME_LENGTH]
+            arrival_time = max(written_at, self._input_line_free_at) + self._wire_time()
+            self._input_line_free_at = arrival_time
+            self._requests.put((arrival_time, request))
+
+    def handle_request(self, request):
+        # returns the response frame for a request or None if the device does not answer it
+        self.requests_received += 1
+        function_nr = request[1]
+        function_sub_nr = request[2]
+        if function_nr == CommandTypes.POWER_REQUEST.value:
+            return self._power_response(function_sub_nr)
+        if function_nr == CommandTypes.DISPLAY_SETTINGS_CHANGE.value:
+            self._change_display_settings(request)
+            return self._frame(function_nr, 0)
+        if function_nr == CommandTypes.STORED_RECORD_COUNT.value:
+            count = len(self.stored_records)
+            return self._frame(function_nr, 0, bytes((count % 255, count // 255)))
+        if function_nr == CommandTypes.READ_EEPROM.value:
+            return self._frame(function_nr, 0, self._read_eeprom(request[2] | request[3] << 8, request[4]))
+        if function_nr in (0x10, 0x19): # delete all records of the eeprom, clear stored power records
+            self.stored_records.clear()
+        return self._frame(function_nr, 0) # remaining commands are acknowledged without payload
+
+    def _power_response(self, function_sub_nr):
+        power = self.optical_power
+        if self.noise:
+            power += self._random.gauss(0, self.noise)
+        if function_sub_nr == 0x00:
+            payload = struct.pack('<fHBB', power, self.adc_value, self.frequency, self.power_adjustment_gear)
+        elif function_sub_nr == 0x80:
+            payload = struct.pack('<fBBBx', power, self.mode, self.wavelength_index, self.battery_level)
+        elif function_sub_nr == 0x01:
+            payload = struct.pack('<ff', power, self.reference_power)
+        else:
+            return None
+        return self._frame(CommandTypes.POWER_REQUEST.value, function_sub_nr, payload)
+
+    def _read_eeprom(self, address, byte_count):
+        # a response has room for 8 bytes, whatever is not stored reads as 0xFF like erased eeprom
+        byte_count = min(byte_count, FRAME_LENGTH - 5)
+        first_record = address // 4
+        records = self.stored_records[first_record:(address + byte_count + 3) // 4]
+        value = struct.pack(f"<{len(records)}f", *records)[address - first_record * 4:][:byte_count]
+        return value.ljust(byte_count, b'\xff')
+
+    def _change_display_settings(self, request):
+        function_sub_nr, direct, value = request[2], request[3], request[4]
+        if function_sub_nr == 0x01:
+            self.wavelength_index = value if direct else (self.wavelength_index + 1) % 6
+        elif function_sub_nr == 0x02:
+            self.mode = value if direct else (self.mode + 1) % 3
+        elif function_sub_nr == 0x03:
+            self.mode = 4
+        elif function_sub_nr == 0x13:
+            self.reference_power = self.optical_power
+        elif function_sub_nr == 0x04:
+            self.backlight_on = bool(value) if direct else not self.backlight_on
+
+    def _frame(self, function_nr, function_sub_nr, payload=b''):
+        return bytes((START_BYTE, function_nr, function_sub_nr, 0, 0)) + payload.ljust(FRAME_LENGTH - 5, b'\x00')
+
+    def _wire_time(self):
+        return FRAME_LENGTH * 10 / self.baudrate if self.baudrate else 0.0 # 8N1 -> 10 bits per byte
+
+    def _start_worker(self):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._process_requests, name="SimulatedPowerMeter", daemon=True)
+            self._worker.start()
+
+    def _process_requests(self):
+        while True:
+            item = self._requests.get()
+            if item is None or self._closed:
+                return
+            arrival_time, request = item
+            response = self.handle_request(request)
+            # the device works on one request after the other and the response line is shared, so both serialise
+            delay = self.response_delay
+            if request[1] == CommandTypes.POWER_REQUEST.value:
+                delay = self.power_request_delays.get(request[2], delay)
+            ready_at = max(arrival_time, self._device_free_at) + delay
+            if self.jitter:
+                ready_at += self._random.uniform(0, self.jitter)
+            self._device_free_at = ready_at
+            if response is None:
+                continue
+            if self._random.random() < self.drop_rate:
+                self.responses_dropped += 1
+                continue
+            if self._random.random() < self.corrupt_rate:
+                response = bytearray(response)
+                response[self._random.randrange(FRAME_LENGTH)] ^= self._random.randrange(1, 256)
+                response = bytes(response)
+                self.responses_corrupted += 1
+            sent_at = max(ready_at, self._line_free_at) + self._wire_time()
+            self._line_free_at = sent_at
+            delay = sent_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            for output in self._outputs:
+                try:
+                    output(response)
+                except OSError:
+                    return
+            self.responses_sent += 1
+
+    def _read_pty(self, master):
+        while not self._closed:
+            try:
+                data = os.read(master, 256)
+            except OSError:
+                return
+            if not data:
+                return
+            self.feed(data)
+
+
+# a pyserial loop:// port that hands everything written to the simulated meter and reads the meter's responses
+class SimulatedSerial(protocol_loop.Serial):
+    def __init__(self, meter, timeout=1):
+        self._meter = meter
+        super().__init__("loop://", baudrate=9600, timeout=timeout)
+
+    def write(self, data):
+        if not self.is_open:
+            return super().write(data) # raises the proper PortNotOpenError
+        self._meter.feed(bytes(data))
+        return len(data)
+
+    def deliver(self, data):
+        if self.is_open:
+            for byte in data:
+                self.queue.put(bytes((byte,)))
@@ -0,0 +1,142 @@
+import math
+import struct
+import threading
+import time
+
+# a traffic capture is a 32 byte header followed by one record per chunk of raw serial traffic:
+# seconds since the capture started, direction and length, then the bytes themselves
+CAPTURE_MAGIC = b"PMTRAFIC"
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct("<8sHxxxxxxd8x") # magic, version, creation time (unix)
+CAPTURE_RECORD = struct.Struct("<dBH") # timestamp, direction, length
+DIRECTION_SENT = 0 # host -> power meter, see DeviceController.send_data
+DIRECTION_RECEIVED = 1 # power meter -> host, as read from the port
+
+
+# records everything the controller sends and receives, see DeviceController.start_traffic_capture
+class TrafficRecorder:
+    def __init__(self, path):
+        self.path = path
+        self.records_written = 0
+        self._lock = threading.Lock() # the port may be read in another thread than the one that writes to it
+        self._start_time = time.perf_counter()
+        self._file = open(path, "wb")
+        self._file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, time.time()))
+
+    def record(self, direction, data):
+        timestamp = time.perf_counter() - self._start_time
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(CAPTURE_RECORD.pack(timestamp, direction, len(data)))
+            self._file.write(data)
+            self.records_written += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_capture(path):
+    # yields (timestamp, direction, data) for every record; a record torn by a crash ends the capture
+    with open(path, "rb") as f:
+        content = f.read()
+    magic, version, _ = CAPTURE_HEADER.unpack_from(content)
+    if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+        raise ValueError(f"{path} is not a supported traffic capture")
+    offset = CAPTURE_HEADER.size
+    while offset + CAPTURE_RECORD.size <= len(content):
+        timestamp, direction, length = CAPTURE_RECORD.unpack_from(content, offset)
+        offset += CAPTURE_RECORD.size
+        if offset + length > len(content):
+            return
+        yield timestamp, direction, content[offset:offset + length]
+        offset += length
+
+
+# plays the received traffic of a capture back in place of a serial.Serial, e.g. DeviceController(port=ReplaySerial(path)).
+# realtime=True delivers every chunk at its recorded time, otherwise everything is available at once.
+# what the controller writes is ignored, so the replay does not depend on the requests being sent again
+class ReplaySerial:
+    def __init__(self, path, realtime=False, speed=1.0, timeout=1):
+        self.port = f"replay://{path}"
+        self.timeout = timeout
+        self.realtime = realtime
+        self.speed = speed # realtime only: 2.0 replays twice as fast as recorded
+        self.is_open = True
+        self.bytes_written = 0
+        self._chunks = [(timestamp, data) for timestamp, direction, data in read_capture(path) if direction == DIRECTION_RECEIVED]
+        self._first_timestamp = self._chunks[0][0] if self._chunks else 0.0
+        self._next_chunk = 0
+        self._pending = bytearray() # delivered but not yet read
+        self._start_time = time.perf_counter()
+        self._closed_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self._next_chunk == len(self._chunks) and not self._pending
+
+    @property
+    def in_waiting(self):
+        self._deliver_due_chunks()
+        return len(self._pending)
+
+    def read(self, size=1):
+        # like serial.Serial.read: timeout None blocks until data arrives, 0 returns at once
+        deadline = math.inf if self.timeout is None else time.perf_counter() + self.timeout
+        while self.is_open:
+            self._deliver_due_chunks()
+            if self._pending or self._next_chunk == len(self._chunks):
+                break
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            self._closed_event.wait(min(self._due_time(self._next_chunk), deadline) - now)
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+        if not data and self.finished:
+            # like an idle port: a read without data takes the timeout, without a timeout it waits until the port is closed
+            if self.timeout is None:
+                self._closed_event.wait()
+            elif self.timeout:
+                self._closed_event.wait(self.timeout)
+        return data
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def close(self):
+        self.is_open = False
+        self._closed_event.set()
+
+    def reset_input_buffer(self):
+        self._pending.clear()
+
+    def _due_time(self, index):
+        return self._start_time + (self._chunks[index][0] - self._first_timestamp) / self.speed
+
+    def _deliver_due_chunks(self):
+        chunks = self._chunks
+        if not self.realtime:
+            for _, data in chunks[self._next_chunk:]:
+                self._pending += data
+            self._next_chunk = len(chunks)
+            return
+        now = time.perf_counter()
+        while self._next_chunk < len(chunks) and self._due_time(self._next_chunk) <= now:
+            self._pending += chunks[self._next_chunk][1]
+            self._next_chunk += 1
+
+
+def replay_into(controller, path):
+    # feeds the received traffic of a capture straight into the controller's decoding, as fast as possible.
+    # returns the number of replayed bytes
+    replayed = 0
+    for _, direction, data in read_capture(path):
+        if direction == DIRECTION_RECEIVED:
+            controller._on_data_received(data)
+            replayed += len(data)
+    return replayed